@@ -0,0 +1,319 @@
+import argparse
+import itertools
+import math
+import multiprocessing
+import multiprocessing.pool
+import os
+import random
+###
+import errorlog
+import events
+import game
+import instrument
+import registry
+import replay
+import sandbox
+
+default_map = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps/default.py')
+
+def make_player(fname, sandboxed=False, seed=None):
+    if sandboxed:
+        return sandbox.SandboxedPlayer(registry.read_bot(fname), seed)
+    return game.Player(registry.read_bot(fname))
+
+def find_bots(path):
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(path, x) for x in os.listdir(path)
+        if x.endswith('.py') and not x.startswith('_'))
+
+def make_pairings(bots, games):
+    # every pair plays `games` matches, switching sides every other match
+    pairings = []
+    for bot1, bot2 in itertools.combinations(bots, 2):
+        for i in range(games):
+            pairings.append((bot1, bot2) if i % 2 == 0 else (bot2, bot1))
+    return pairings
+
+def init_worker(map_file):
+    game.init_settings(map_file)
+
+def run_match(pairing, sandboxed=False, replay_file=None, seed=None,
+        profile=False, events_file=None, play_out=False):
+    # the game seeds the engine; seeding the random module too makes bots
+    # that use it (in this process or in forked sandboxes) repeatable
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(31)
+    random.seed(seed)
+    players = [make_player(x, sandboxed, seed) for x in pairing]
+    writer = None
+    if replay_file is not None:
+        writer = replay.ReplayWriter(open(replay_file, 'wb'))
+    profiler = None
+    if profile:
+        profiler = instrument.Profiler([os.path.basename(x) for x in pairing])
+    feed = None
+    if events_file is not None:
+        events_sink = open(events_file, 'w')
+        feed = events.EventWriter(events_sink)
+    # errors are only counted here; main prints one table for the batch
+    error_log = errorlog.ErrorLog(echo=False,
+        max_reports=game.settings.max_error_reports)
+    try:
+        g = game.Game(*players, replay=writer, seed=seed, profiler=profiler,
+            events=feed, error_log=error_log)
+        # a match ends once it is decided, see Game.finished
+        while (g.turns < g.settings.max_turns if play_out else not g.finished()):
+            g.run_turn()
+    finally:
+        for player in players:
+            player.close()
+        if writer is not None:
+            writer.close()
+        if feed is not None:
+            feed.close()
+            events_sink.close()
+    result = {'players': pairing, 'scores': g.get_scores(), 'seed': seed,
+        'turns': g.turns, 'errors': g.error_log.summary()}
+    if profiler is not None:
+        result['profile'] = profiler.summary()
+    return result
+
+def run_job(job):
+    pairing, options = job
+    return run_match(pairing, **options)
+
+def replay_name(replay_dir, index, pairing, ext='.rgr'):
+    names = [os.path.splitext(os.path.basename(x))[0] for x in pairing]
+    return os.path.join(replay_dir, '%05d-%s-vs-%s%s' % ((index,) + tuple(names) + (ext,)))
+
+def run_batch(pairings, processes=None, map_file=default_map, sandboxed=False,
+        replay_dir=None, seed=None, profile=False, events_dir=None, play_out=False):
+    return list(iter_batch(pairings, processes, map_file, sandboxed, replay_dir,
+        seed, profile, events_dir, play_out))
+
+def iter_batch(pairings, processes=None, map_file=default_map, sandboxed=False,
+        replay_dir=None, seed=None, profile=False, events_dir=None, play_out=False,
+        ordered=False):
+    # yields results as matches finish, or with ordered in the order of
+    # pairings. closing the generator early drops the matches not started
+    # yet.
+    game.init_settings(map_file)
+    jobs = []
+    for i, pairing in enumerate(pairings):
+        options = {'sandboxed': sandboxed, 'profile': profile, 'play_out': play_out}
+        if seed is not None:
+            options['seed'] = seed + i
+        if replay_dir is not None:
+            options['replay_file'] = replay_name(replay_dir, i, pairing)
+        if events_dir is not None:
+            options['events_file'] = replay_name(events_dir, i, pairing, '.jsonl')
+        jobs.append((pairing, options))
+
+    if processes == 1:
+        for job in jobs:
+            yield run_job(job)
+        return
+
+    # sandboxed bots already run in their own processes, which the daemonic
+    # workers of a process pool may not start
+    if sandboxed:
+        pool = multiprocessing.pool.ThreadPool(processes)
+    else:
+        pool = multiprocessing.Pool(processes, init_worker, (map_file,))
+    try:
+        results = pool.imap if ordered else pool.imap_unordered
+        for result in results(run_job, jobs):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def summarize(results):
+    stats = {}
+    for result in results:
+        scores = result['scores']
+        for i, bot in enumerate(result['players']):
+            s = stats.setdefault(bot, {
+                'games': 0, 'wins': 0, 'losses': 0, 'draws': 0,
+                'score': 0, 'opponent_score': 0})
+            mine, theirs = scores[i], scores[1 - i]
+            s['games'] += 1
+            s['score'] += mine
+            s['opponent_score'] += theirs
+            if mine > theirs:
+                s['wins'] += 1
+            elif mine < theirs:
+                s['losses'] += 1
+            else:
+                s['draws'] += 1
+    return stats
+
+class SequentialTest:
+    # a sequential probability ratio test on one bot's matches against
+    # another. a match scores 1 for a win, 0.5 for a draw and 0 for a loss;
+    # the test decides between an expected score of 0.5 + margin (better)
+    # and 0.5 - margin (worse), each accepted with the given confidence.
+    # a lopsided pair is decided after a handful of matches, an even one
+    # may never be.
+    def __init__(self, bot, margin=0.05, confidence=0.95):
+        self.bot = bot
+        error = 1 - confidence
+        self.lower = math.log(error / (1 - error))
+        self.upper = math.log((1 - error) / error)
+        better, worse = 0.5 + margin, 0.5 - margin
+        self._win = math.log(better / worse)
+        self._loss = math.log((1 - better) / (1 - worse))
+        self.llr = 0.0
+        self.games = 0
+        self.verdict = None
+
+    def add(self, result):
+        i = list(result['players']).index(self.bot)
+        mine, theirs = result['scores'][i], result['scores'][1 - i]
+        score = 1.0 if mine > theirs else 0.0 if mine < theirs else 0.5
+        self.llr += score * self._win + (1 - score) * self._loss
+        self.games += 1
+        if self.llr >= self.upper:
+            self.verdict = 'better'
+        elif self.llr <= self.lower:
+            self.verdict = 'worse'
+        return self.verdict
+
+def summarize_errors(results):
+    # error counts per bot and site over all matches, most frequent first
+    totals = {}
+    for result in results:
+        for error in result['errors']:
+            bot = result['players'][error['player_id']]
+            key = (bot, error['error'], error['file'], error['line'], error['function'])
+            total = totals.setdefault(key, {'count': 0, 'matches': 0,
+                'message': error['message']})
+            total['count'] += error['count']
+            total['matches'] += 1
+    return sorted(totals.iteritems(), key=lambda x: x[1]['count'], reverse=True)
+
+def print_errors(totals):
+    print 'robot errors:'
+    for (bot, error, fname, line, function), total in totals:
+        print '%8d in %4d matches  %s: %s (%s:%d in %s)' % (total['count'],
+            total['matches'], os.path.basename(bot), total['message'],
+            fname, line, function)
+
+def print_summary(stats):
+    width = max(len(os.path.basename(x)) for x in stats)
+    print '%-*s %6s %6s %6s %6s %8s %8s' % (
+        width, 'bot', 'games', 'wins', 'losses', 'draws', 'score', 'against')
+    ranked = sorted(stats.iteritems(),
+        key=lambda x: (x[1]['wins'] - x[1]['losses'], x[1]['score']), reverse=True)
+    for bot, s in ranked:
+        print '%-*s %6d %6d %6d %6d %8.2f %8.2f' % (
+            width, os.path.basename(bot), s['games'], s['wins'], s['losses'],
+            s['draws'], float(s['score']) / s['games'],
+            float(s['opponent_score']) / s['games'])
+
+def print_result(result):
+    errors = sum(x['count'] for x in result['errors'])
+    print '%s vs %s: %d-%d (seed %d, %d robot errors)' % (
+        tuple(os.path.basename(x) for x in result['players']) +
+        tuple(result['scores']) + (result['seed'], errors))
+
+def run_sprt(matches, bot, margin, confidence, verbose=False):
+    # takes results until the test decides. matches should come in the
+    # order they were started: a match that ends early finishes first, so
+    # taking them as they finish would favour lopsided results.
+    test = SequentialTest(bot, margin, confidence)
+    results = []
+    try:
+        for result in matches:
+            results.append(result)
+            if verbose:
+                print_result(result)
+            if test.add(result) is not None:
+                break
+    finally:
+        matches.close()
+    return results, test
+
+def print_verdict(test, bots):
+    names = [os.path.basename(x) for x in bots]
+    if test.verdict is None:
+        print 'undecided after %d matches (LLR %.2f, bounds %.2f, %.2f)' % (
+            test.games, test.llr, test.lower, test.upper)
+    else:
+        print '%s is %s than %s after %d matches (LLR %.2f)' % (names[0],
+            test.verdict, names[1], test.games, test.llr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run robot game matches without a window.')
+    parser.add_argument('bots', nargs='+',
+        help='two bot files, or a directory of bots to play round robin')
+    parser.add_argument('-n', '--games', type=int, default=100,
+        help='number of matches per pairing')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+        help='worker processes (default: one per cpu)')
+    parser.add_argument('-m', '--map', default=default_map,
+        help='map file')
+    parser.add_argument('-s', '--sandbox', action='store_true',
+        help='run each bot in its own time-limited worker process')
+    parser.add_argument('-r', '--replays', default=None, metavar='DIR',
+        help='save a replay of every match in DIR')
+    parser.add_argument('-e', '--events', default=None, metavar='DIR',
+        help='stream the events of every match to a .jsonl file in DIR')
+    parser.add_argument('--seed', type=int, default=None,
+        help='seed of the first match; match i gets seed + i')
+    parser.add_argument('-v', '--verbose', action='store_true',
+        help='print the score and seed of every match')
+    parser.add_argument('--profile', default=None, metavar='FILE',
+        help='time every match and write the results to FILE (.json or .csv)')
+    parser.add_argument('--play-out', action='store_true',
+        help='play every match to max_turns, even once it is decided')
+    parser.add_argument('--sprt', action='store_true',
+        help='with two bots, stop as soon as one is shown to be better; '
+            '-n is then the most matches to play')
+    parser.add_argument('--confidence', type=float, default=0.95,
+        help='confidence of the --sprt verdict (default: 0.95)')
+    parser.add_argument('--margin', type=float, default=0.05,
+        help='--sprt tells a match score of 0.5 + margin from 0.5 - margin '
+            '(default: 0.05)')
+    args = parser.parse_args(argv)
+
+    bots = list(itertools.chain.from_iterable(find_bots(x) for x in args.bots))
+    if len(bots) < 2:
+        parser.error('need at least two bots')
+    if args.sprt and len(bots) != 2:
+        parser.error('--sprt compares exactly two bots')
+    if not 0 < args.margin < 0.5:
+        parser.error('--margin must be between 0 and 0.5')
+    if not 0.5 < args.confidence < 1:
+        parser.error('--confidence must be between 0.5 and 1')
+
+    for path in (args.replays, args.events):
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+
+    matches = iter_batch(make_pairings(bots, args.games), args.processes,
+        args.map, args.sandbox, args.replays, args.seed, args.profile is not None,
+        args.events, args.play_out, ordered=args.sprt)
+    if args.sprt:
+        results, test = run_sprt(matches, bots[0], args.margin, args.confidence,
+            args.verbose)
+    else:
+        results = list(matches)
+        if args.verbose:
+            for result in sorted(results, key=lambda x: x['seed']):
+                print_result(result)
+    print_summary(summarize(results))
+    if args.sprt:
+        print_verdict(test, bots)
+    totals = summarize_errors(results)
+    if totals:
+        print_errors(totals)
+    if args.profile is not None:
+        summaries = [x['profile'] for x in sorted(results, key=lambda x: x['seed'])]
+        instrument.write_report(args.profile, summaries)
+        instrument.print_report(instrument.merge(summaries))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# synthetic bots for the engine benchmarks. each stresses a different part
+# of the engine: idle bots only cost act() calls, chasers pile into the
+# center and collide, suicide bots keep the damage paths busy and random
+# movers spread out over the whole board.
+import random
+
+import rg
+
+class IdleBot:
+    def act(self, game):
+        return ['guard']
+
+class ChaseBot:
+    def act(self, game):
+        target, best = None, None
+        for loc, bot in game['robots'].iteritems():
+            if bot['player_id'] != self.player_id:
+                d = rg.wdist(loc, self.location)
+                if d <= 1:
+                    return ['attack', loc]
+                if best is None or d < best:
+                    target, best = loc, d
+        if target is None:
+            target = rg.CENTER_POINT
+        return ['move', rg.toward(self.location, target)]
+
+class SuicideBot:
+    def act(self, game):
+        for loc in rg.locs_around(self.location):
+            bot = game['robots'].get(loc)
+            if bot is not None and bot['player_id'] != self.player_id:
+                return ['suicide']
+        return ['move', rg.toward(self.location, rg.CENTER_POINT)]
+
+class RandomBot:
+    def act(self, game):
+        locs = rg.locs_around(self.location, filter_out=('invalid', 'obstacle'))
+        if not locs:
+            return ['guard']
+        return [random.choice(('move', 'move', 'attack')), random.choice(locs)]
+
+BOTS = {
+    'idle': IdleBot,
+    'chase': ChaseBot,
+    'suicide': SuicideBot,
+    'random': RandomBot,
+}
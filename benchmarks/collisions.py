@@ -0,0 +1,56 @@
+# micro-benchmark for settling a turn's actions on a crowded board.
+#
+#   python benchmarks/collisions.py [density] [seconds]
+#
+# fills `density` of the walkable squares with robots of both players, each
+# moving, attacking or guarding into a random neighbouring square, settles
+# the move graph once and then reports how many actions per second
+# issue_command gets through, collisions included.
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import game
+import rg
+
+def make_board(density, seed=0):
+    rnd = random.Random(seed)
+    walkable = [(x, y)
+        for x in range(game.settings.board_size)
+        for y in range(game.settings.board_size)
+        if 'obstacle' not in rg.loc_types((x, y))]
+
+    field = game.Field(game.settings.board_size)
+    actions = {}
+    for loc in rnd.sample(walkable, int(len(walkable) * density)):
+        robot = game.InternalRobot(loc, game.settings.robot_hp, rnd.randint(0, 1), field)
+        field[loc] = robot
+        target = rnd.choice(rg.locs_around(loc, filter_out=('invalid', 'obstacle')))
+        actions[robot] = [rnd.choice(('move', 'move', 'attack', 'guard')), target]
+    return field, actions
+
+def run(density, seconds):
+    field, actions = make_board(density)
+    action_table = game.ActionTable(actions, field)
+    start = dict((robot, (robot.location, robot.hp)) for robot in actions)
+
+    turns = 0
+    began = time.time()
+    while time.time() - began < seconds:
+        for robot, (location, hp) in start.iteritems():
+            robot.location, robot.hp = location, hp
+        for robot, action in action_table.iteritems():
+            robot.issue_command(action, action_table)
+        turns += 1
+    elapsed = time.time() - began
+    return len(actions), turns * len(actions) / elapsed
+
+if __name__ == '__main__':
+    density = float(sys.argv[1]) if len(sys.argv) > 1 else 0.8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+
+    game.init_settings(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../maps/default.py'))
+    robots, rate = run(density, seconds)
+    print '%d robots, %.0f actions/sec' % (robots, rate)
@@ -0,0 +1,157 @@
+# engine benchmark suite: plays whole games between synthetic bots on
+# generated maps and reports turns/sec, act() calls/sec and peak memory.
+#
+#   python benchmarks/engine.py [-g GAMES] [--save NAME] [--compare NAME]
+#
+# the sweep varies one of board size, spawn_per_player and obstacle density
+# at a time away from the default 19x19 setup. every scenario runs in a
+# fresh process so its peak memory is its own. --save keeps the results
+# as a baseline in benchmarks/baselines/NAME.json; --compare checks the
+# current engine against one and exits non-zero if any scenario got more
+# than --threshold slower.
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import bots
+import game
+import mapgen
+
+baseline_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+BASE = {'board_size': 19, 'spawn_per_player': 5, 'density': 0.0}
+SWEEP = {
+    'board_size': (31, 51),
+    'spawn_per_player': (10, 20),
+    'density': (0.1, 0.25),
+}
+MATCHUPS = (
+    ('chase', 'chase'),
+    ('chase', 'suicide'),
+    ('random', 'chase'),
+    ('random', 'idle'),
+)
+
+def make_map(board_size, density, seed=0):
+    # a disc like the default map, with `density` of its inside blocked
+    spawn, normal, obstacles = mapgen.disc(board_size)
+    obstacles.extend(random.Random(seed).sample(normal, int(len(normal) * density)))
+    return {'spawn': spawn, 'obstacle': obstacles}
+
+def make_scenarios():
+    scenarios = [dict(BASE)]
+    for key in sorted(SWEEP):
+        for value in SWEEP[key]:
+            scenario = dict(BASE)
+            scenario[key] = value
+            scenarios.append(scenario)
+    return scenarios
+
+def scenario_name(scenario):
+    return 'board%(board_size)d-spawn%(spawn_per_player)d-density%(density).2f' % scenario
+
+class CountingPlayer(game.Player):
+    def __init__(self, robot):
+        game.Player.__init__(self, robot=robot)
+        self.calls = 0
+
+    def get_actions(self, robots, game_info, profiler=None, error_log=None):
+        self.calls += len(robots)
+        return game.Player.get_actions(self, robots, game_info, profiler, error_log)
+
+def run_scenario(scenario, games):
+    settings = game.make_settings(
+        map_data=make_map(scenario['board_size'], scenario['density']),
+        board_size=scenario['board_size'],
+        spawn_per_player=scenario['spawn_per_player'])
+
+    turns = calls = 0
+    elapsed = 0.0
+    for seed in range(games):
+        for matchup in MATCHUPS:
+            random.seed(seed)
+            players = [CountingPlayer(bots.BOTS[x]()) for x in matchup]
+            g = game.Game(*players, seed=seed, settings=settings)
+            began = time.time()
+            while g.turns < settings.max_turns:
+                g.run_turn()
+            elapsed += time.time() - began
+            turns += g.turns
+            calls += sum(x.calls for x in players)
+
+    return {
+        'turns_per_sec': turns / elapsed,
+        'act_calls_per_sec': calls / elapsed,
+        'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+def run_isolated(scenario, games):
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run_scenario, (scenario, games))
+    finally:
+        pool.close()
+        pool.join()
+
+def baseline_file(name):
+    return os.path.join(baseline_dir, name + '.json')
+
+def compare(results, baseline, threshold):
+    slower = []
+    print '%-36s %12s %12s %8s' % ('scenario', 'turns/sec', 'baseline', 'change')
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        now = results[name]['turns_per_sec']
+        then = baseline[name]['turns_per_sec']
+        change = now / then - 1
+        flag = ''
+        if change < -threshold:
+            flag = ' slower'
+            slower.append(name)
+        print '%-36s %12.1f %12.1f %+7.1f%%%s' % (name, now, then, change * 100, flag)
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the game engine.')
+    parser.add_argument('-g', '--games', type=int, default=2,
+        help='games per matchup and scenario')
+    parser.add_argument('--save', default=None, metavar='NAME',
+        help='save the results as baseline NAME')
+    parser.add_argument('--compare', default=None, metavar='NAME',
+        help='compare the results against baseline NAME')
+    parser.add_argument('--threshold', type=float, default=0.1,
+        help='slowdown that counts as a regression (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare is not None:
+        baseline = json.load(open(baseline_file(args.compare)))
+
+    results = {}
+    print '%-36s %12s %12s %10s' % ('scenario', 'turns/sec', 'acts/sec', 'peak MB')
+    for scenario in make_scenarios():
+        name = scenario_name(scenario)
+        result = results[name] = run_isolated(scenario, args.games)
+        print '%-36s %12.1f %12.0f %10.1f' % (name, result['turns_per_sec'],
+            result['act_calls_per_sec'], result['peak_memory_mb'])
+
+    if args.save is not None:
+        if not os.path.isdir(baseline_dir):
+            os.makedirs(baseline_dir)
+        with open(baseline_file(args.save), 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        print
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
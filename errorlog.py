@@ -0,0 +1,122 @@
+import collections
+import re
+import sys
+import traceback
+###
+from settings import settings
+
+# errors raised by bots during one game, counted per site: the player, the
+# exception type and the innermost line it was raised from. only the first
+# error at a site is formatted and kept, with its traceback, and only the
+# first max_error_reports sites of a game are printed; everything after
+# that is just counted. a buggy bot costs a counter increment per robot
+# per turn instead of a printed traceback.
+
+FRAME_LINE = re.compile(r'^\s*File "(.*)", line (\d+), in (.*)$')
+
+def print_robot_exception(location, text):
+    print "The robot at (%s, %s) raised an exception:" % location
+    print '-' * 60
+    sys.stdout.write(text)
+    print '-' * 60
+
+def exception_site(exc_type, tb):
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    code = tb.tb_frame.f_code
+    return (exc_type.__name__, code.co_filename, tb.tb_lineno, code.co_name)
+
+def text_site(text):
+    # the site of a traceback that was already formatted, e.g. by a worker
+    lines = text.strip().splitlines()
+    filename, lineno, function = '', 0, ''
+    for line in lines:
+        match = FRAME_LINE.match(line)
+        if match is not None:
+            filename, lineno, function = match.group(1), int(match.group(2)), match.group(3)
+    error = lines[-1].split(':')[0] if lines else ''
+    return (error, filename, lineno, function)
+
+def report(error_log, player_id, location, text=None, site=None):
+    # call from an except block unless text is given. without a log the
+    # traceback is printed right away, as it always was
+    if error_log is None:
+        print_robot_exception(location, text or traceback.format_exc())
+    else:
+        error_log.record(player_id, location, text, site)
+
+class ErrorLog:
+    def __init__(self, echo=True, max_reports=None):
+        self.echo = echo
+        if max_reports is None:
+            max_reports = settings.max_error_reports
+        self.max_reports = max_reports
+        self.turn = 0
+        self.sites = collections.OrderedDict()
+        self._printed = 0
+        self._pending = collections.OrderedDict()
+        self._sent = set()
+
+    def record(self, player_id, location, text=None, site=None, count=1):
+        if site is None:
+            if text is None:
+                exc_type, exc, tb = sys.exc_info()
+                site = exception_site(exc_type, tb)
+            else:
+                site = text_site(text)
+        key = (player_id,) + tuple(site)
+
+        entry = self.sites.get(key)
+        if entry is None:
+            if text is None:
+                text = traceback.format_exc()
+            lines = text.strip().splitlines()
+            entry = self.sites[key] = {
+                'player_id': player_id,
+                'error': key[1],
+                'file': key[2],
+                'line': key[3],
+                'function': key[4],
+                'message': lines[-1] if lines else '',
+                'traceback': text,
+                'location': location,
+                'count': 0,
+                'first_turn': self.turn,
+                'last_turn': self.turn,
+            }
+            self.print_entry(entry)
+        entry['count'] += count
+        entry['last_turn'] = self.turn
+        self._pending[key] = self._pending.get(key, 0) + count
+
+    def print_entry(self, entry):
+        if not self.echo or self._printed >= self.max_reports:
+            return
+        print_robot_exception(entry['location'], entry['traceback'])
+        self._printed += 1
+        if self._printed == self.max_reports:
+            print 'more robot errors this game are only counted'
+
+    def drain(self):
+        # the counts recorded since the last drain, with the traceback of
+        # sites not drained before, for passing on to another log
+        deltas = []
+        for key, count in self._pending.iteritems():
+            text = None
+            if key not in self._sent:
+                text = self.sites[key]['traceback']
+                self._sent.add(key)
+            deltas.append((key, self.sites[key]['location'], text, count))
+        self._pending.clear()
+        return deltas
+
+    def merge(self, deltas):
+        for key, location, text, count in deltas:
+            self.record(key[0], tuple(location), text or '', key[1:], count)
+
+    def total(self):
+        return sum(x['count'] for x in self.sites.itervalues())
+
+    def summary(self):
+        return sorted((dict(x) for x in self.sites.itervalues()),
+            key=lambda x: x['count'], reverse=True)
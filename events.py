@@ -0,0 +1,105 @@
+import json
+import Queue
+import threading
+import time
+
+# a live feed of what happens in a game, one JSON object per line, for
+# dashboards and analyzers that tail games as they are played. every event
+# has 'event' and 'turn'; robots are named by their id, squares are [x, y].
+#
+#   spawn      robot, player_id, location, hp
+#   action     robot, player_id, location, action
+#   collision  robot, location, action ('move' or 'attack'), target,
+#              kind ('guard', 'block' or 'move'), robots collided with
+#   move       robot, from, to
+#   damage     robot, location, amount, source (the robot that dealt it)
+#   death      robot, player_id, location, cause ('damage' or 'spawn')
+#   turn       scores, once the turn is over
+#   dropped    events, the number of events lost before this one
+#
+# events are buffered in memory and handed to a writer thread in chunks, at
+# the end of a turn once buffer_size bytes or interval seconds have piled
+# up. at most max_pending chunks wait for the sink; past that the game
+# waits for the sink to catch up, or with block=False the chunk is dropped
+# and a 'dropped' event says so.
+
+class EventWriter:
+    def __init__(self, sink, buffer_size=65536, interval=0.5, max_pending=16,
+            block=True):
+        self.turn = 0
+        self.dropped = 0
+        self._sink = sink
+        self._buffer_size = buffer_size
+        self._interval = interval
+        self._block = block
+        self._lines = []
+        self._size = 0
+        self._unreported = 0
+        self._flushed = time.time()
+        self._error = None
+        self._queue = Queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self.write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, event, **fields):
+        fields['event'] = event
+        fields['turn'] = self.turn
+        line = json.dumps(fields, sort_keys=True, default=repr) + '\n'
+        self._lines.append(line)
+        self._size += len(line)
+
+    def end_turn(self):
+        if (self._size >= self._buffer_size or
+                time.time() - self._flushed >= self._interval):
+            self.flush()
+
+    def flush(self, wait=False):
+        # hands the buffered events to the writer thread, and with wait
+        # returns once they are written
+        self.check()
+        if self._lines or self._unreported:
+            if self._unreported:
+                self._lines.insert(0, json.dumps({'event': 'dropped',
+                    'turn': self.turn, 'events': self._unreported}) + '\n')
+            chunk = ''.join(self._lines)
+            try:
+                self._queue.put(chunk, self._block or wait)
+                self._unreported = 0
+            except Queue.Full:
+                lost = len(self._lines) - (1 if self._unreported else 0)
+                self.dropped += lost
+                self._unreported += lost
+            self._lines = []
+            self._size = 0
+        self._flushed = time.time()
+        if wait:
+            self._queue.join()
+            self.check()
+
+    def check(self):
+        # a sink that failed fails the game at its next flush
+        if self._error is not None:
+            raise self._error
+
+    def write_loop(self):
+        while True:
+            chunk = self._queue.get()
+            try:
+                if chunk is None:
+                    return
+                if self._error is None:
+                    self._sink.write(chunk)
+                    if hasattr(self._sink, 'flush'):
+                        self._sink.flush()
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def close(self):
+        # writes whatever is left; the sink itself stays open
+        self.flush(wait=True)
+        self._queue.put(None)
+        self._thread.join()
+        self.check()
@@ -0,0 +1,81 @@
+import threading
+
+# frame sources for the viewer. a frame is (turn, robots) with robots a
+# list of (location, hp, player_id) after that many turns, the way
+# replay.ReplayReader gives them. frames are numbered from 0 (the board
+# before the first turn) and kept, so the viewer can seek anywhere it has
+# seen.
+
+class GameFrames:
+    # plays a game in a background thread, so slow bots never block the
+    # viewer. the thread stays at most `lookahead` frames ahead of the
+    # frame being looked at.
+    def __init__(self, game, max_turns, lookahead=50):
+        self._game = game
+        self.total = max_turns + 1
+        self._lookahead = lookahead
+        self._frames = [(0, [])]
+        self._position = 0
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self.produce)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def produce(self):
+        while self._game.turns < self.total - 1:
+            with self._cond:
+                while (not self._stopped and
+                        len(self._frames) > self._position + self._lookahead):
+                    self._cond.wait()
+                if self._stopped:
+                    return
+            self._game.run_turn()
+            robots = [(loc, info['hp'], info['player_id'])
+                for loc, info in self._game.get_game_info()['robots'].iteritems()]
+            with self._cond:
+                self._frames.append((self._game.turns, robots))
+
+    def __len__(self):
+        return len(self._frames)
+
+    def done(self):
+        return len(self._frames) == self.total or not self._thread.is_alive()
+
+    def frame(self, index):
+        return self._frames[index]
+
+    def request(self, index):
+        # the frame the viewer is at or wants; the game runs on up to it
+        with self._cond:
+            self._position = index
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+class ReplayFrames:
+    def __init__(self, reader):
+        self._reader = reader
+        self.total = len(reader) + 1
+
+    def __len__(self):
+        return self.total
+
+    def done(self):
+        return True
+
+    def frame(self, index):
+        if index == 0:
+            return (0, [])
+        turn, robots, actions = self._reader.read_turn(index - 1)
+        return (turn + 1, robots)
+
+    def request(self, index):
+        pass
+
+    def close(self):
+        self._reader.close()
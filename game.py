@@ -1,31 +1,59 @@
-import ast
 import inspect
 import random
-import sys
 import traceback
-import imp
 ###
-from robotexception import *
-from settings import settings
+from settings import settings, AttrDict
+import errorlog
+import instrument
+import mapcache
+import registry
 import rg
 
+# results of InternalRobot.can_act, paired with the robot(s) collided with
+INVALID, FREE, GUARD_COLLISION, BLOCK_COLLISION, MOVE_COLLISION = range(5)
+COLLISION_KINDS = {GUARD_COLLISION: 'guard', BLOCK_COLLISION: 'block',
+    MOVE_COLLISION: 'move'}
+
+# the module level settings, for games that are not given their own
+default_settings = settings
+
 def init_settings(map_file):
+    use_map(mapcache.load_file(map_file))
+
+def apply_map(map_data):
+    use_map(mapcache.load_data(map_data))
+
+def use_map(compiled_map):
     global settings
-    map_data = ast.literal_eval(open(map_file).read())
-    settings.spawn_coords = map_data['spawn']
-    settings.obstacles = map_data['obstacle']
+    load_map(settings, compiled_map)
     rg.set_settings(settings)
 
+def load_map(s, compiled_map):
+    s.compiled_map = compiled_map
+    s.spawn_coords = compiled_map.spawn
+    s.obstacles = compiled_map.obstacles
+
+def make_settings(map_file=None, map_data=None, **overrides):
+    # settings for one game, leaving the module level ones alone: a copy of
+    # them with overrides and, if given, a map of its own
+    s = AttrDict(settings)
+    s.update(overrides)
+    if map_file is not None:
+        load_map(s, mapcache.load_file(map_file, s.board_size))
+    elif map_data is not None:
+        load_map(s, mapcache.load_data(map_data, s.board_size))
+    return s
+
 class DefaultRobot:
     def act(self, game):
         return ['guard']
 
 class Player:
     def __init__(self, code=None, robot=None):
+        self._mod = None
         if code is not None:
             self._robot = None
-            self._mod = imp.new_module('usercode%d' % id(self))
-            exec code in self._mod.__dict__
+            self._mod = registry.new_module(code)
         elif robot is not None:
             self._robot = robot
         else:
@@ -43,13 +71,111 @@ class Player:
         self._robot = self.get_usercode_obj('Robot', DefaultRobot)
         return self._robot
 
-class InternalRobot:
-    def __init__(self, location, hp, player_id, field):
+    def notify_new_turn(self):
+        user_robot = self.get_robot()
+        if hasattr(user_robot, 'on_new_turn'):
+            if inspect.ismethod(user_robot.on_new_turn):
+                user_robot.on_new_turn()
+
+    def call_act(self, user_robot, game_info):
+        return user_robot.act(game_info)
+
+    def call_act_all(self, user_robot, game_info):
+        return user_robot.act_all(game_info)
+
+    def get_actions(self, robots, game_info, profiler=None, error_log=None):
+        settings = rg.active().settings
+        user_robot = self.get_robot()
+        actions = {}
+        if robots and hasattr(user_robot, 'act_all'):
+            if inspect.ismethod(user_robot.act_all):
+                actions = self.get_planned_actions(user_robot, robots,
+                    game_info, profiler, error_log)
+
+        has_act = hasattr(user_robot, 'act')
+        for robot in robots:
+            if robot in actions:
+                continue
+            if not has_act:
+                actions[robot] = ['guard']
+                continue
+            for prop in settings.exposed_properties:
+                setattr(user_robot, prop, getattr(robot, prop))
+
+            if profiler is not None:
+                start = instrument.timer()
+            try:
+                next_action = self.call_act(user_robot, game_info)
+                if not InternalRobot.is_valid_action(next_action, settings):
+                    raise Exception('%s is not a valid action' % str(next_action))
+            except Exception:
+                errorlog.report(error_log, robot.player_id, robot.location)
+                if profiler is not None:
+                    profiler.record_exception(robot.player_id)
+                next_action = ['guard']
+            if profiler is not None:
+                profiler.record_act(robot.player_id, instrument.timer() - start)
+            actions[robot] = next_action
+        return actions
+
+    def get_planned_actions(self, user_robot, robots, game_info, profiler=None,
+            error_log=None):
+        # act_all(game) plans the whole turn in one call and returns a
+        # location -> action map; robots it leaves out fall back to act()
+        settings = rg.active().settings
+        player_id = robots[0].player_id
+        user_robot.player_id = player_id
+
+        if profiler is not None:
+            start = instrument.timer()
+        try:
+            planned = dict(self.call_act_all(user_robot, game_info))
+        except Exception:
+            text = traceback.format_exc()
+            for robot in robots:
+                errorlog.report(error_log, player_id, robot.location, text)
+                if profiler is not None:
+                    profiler.record_exception(player_id)
+            return dict((x, ['guard']) for x in robots)
+        finally:
+            if profiler is not None:
+                profiler.record_act(player_id, instrument.timer() - start)
+
+        actions = {}
+        for robot in robots:
+            if robot.location not in planned:
+                continue
+            action = planned[robot.location]
+            try:
+                valid = InternalRobot.is_valid_action(action, settings)
+            except Exception:
+                valid = False
+            if not valid:
+                errorlog.report(error_log, player_id, robot.location,
+                    'Exception: %s is not a valid action\n' % str(action),
+                    ('Exception', '<act_all>', 0, 'act_all'))
+                if profiler is not None:
+                    profiler.record_exception(player_id)
+                action = ['guard']
+            actions[robot] = action
+        return actions
+
+    def close(self):
+        if self._mod is not None:
+            registry.release_module(self._mod)
+            self._mod = None
+        self._robot = None
+
+class InternalRobot(object):
+    __slots__ = ('robot_id', 'location', 'hp', 'player_id', 'field')
+
+    def __init__(self, location, hp, player_id, field, robot_id=None):
+        self.robot_id = robot_id
         self.location = location
         self.hp = hp
         self.player_id = player_id
         self.field = field
-        
+
     @staticmethod
     def parse_command(action):
         return (action[0], action[1:])
@@ -61,113 +187,191 @@ class InternalRobot:
         if cmd == 'suicide':
             self.call_suicide(actions)
 
-    def get_robots_around(self, loc):
-        locs_around = rg.locs_around(loc, filter_out=['obstacle', 'invalid'])
-        locs_around.append(loc)
-
-        robots = [self.field[x] for x in locs_around]
-        return [x for x in robots if x is not None]
-
-    def movable_loc(self, loc):
+    def movable_loc(self, loc, around=None):
+        if around is not None and self.location in around:
+            return loc in around[self.location]
         good_around = rg.locs_around(self.location,
-            filter_out=['invalid', 'obstacle'])
+            filter_out=('invalid', 'obstacle'))
         return loc in good_around
 
-    def can_act(self, loc, action_table, no_raise=False, move_stack=None):
-        global settings
+    def can_act(self, loc, action_table):
+        if not self.movable_loc(loc, action_table.around):
+            return INVALID, None
+
+        moving = [x for x in action_table.movers.get(loc, ()) if x is not self]
+        occupant = self.field[loc]
+        if occupant is not None and occupant not in moving:
+            cmd = action_table.command(occupant)
+            if cmd == 'guard':
+                return GUARD_COLLISION, occupant
+            if cmd == 'attack':
+                return BLOCK_COLLISION, occupant
+            if cmd == 'move' and not action_table.vacates(occupant, self):
+                return BLOCK_COLLISION, occupant
 
-        if move_stack is not None and self in move_stack:
-            return self == move_stack[0]
-        if not self.movable_loc(loc):
-            return False
-
-        moving = []
-
-        nearby_robots = self.get_robots_around(loc)
-        for robot in nearby_robots:
-            if robot == self:
-                continue
-
-            cmd, params = InternalRobot.parse_command(action_table[robot])
-
-            if cmd == 'suicide' and robot.location == loc:
-                continue
-            if cmd == 'guard' and robot.location == loc:
-                if no_raise:
-                    return False
-                raise UnitGuardCollision(robot)
-            if cmd == 'attack' and robot.location == loc:
-                if no_raise:
-                    return False
-                raise UnitBlockCollision(robot)
-            if cmd == 'move':
-                if params[0] == loc:
-                    moving.append(robot)
-                elif robot.location == loc:
-                    if move_stack is None:
-                        move_stack = [self]
-                    move_stack.append(robot)
-                    if not robot.can_act(params[0], action_table, True, move_stack):
-                        if no_raise:
-                            return False
-                        raise UnitBlockCollision(robot)
-                            
         if len(moving) > 0:
-            if no_raise:
-                return False
-            raise UnitMoveCollision(moving)
-        return True
+            return MOVE_COLLISION, moving
+        return FREE, None
 
     def call_move(self, loc, action_table):
-        global settings
-        try:
-            if self.can_act(loc, action_table):
-                self.location = loc
-        except UnitGuardCollision as e:
-            if e.other_robot.player_id != self.player_id:
-                self.hp -= settings.collision_damage
-        except UnitMoveCollision as e:
-            for robot in e.other_robots:
+        settings = action_table.settings
+        result, other = self.can_act(loc, action_table)
+        action_table.collisions[result] += 1
+        if action_table.events is not None:
+            action_table.record_collision(self, 'move', loc, result, other)
+        if result == FREE:
+            self.location = loc
+        elif result == GUARD_COLLISION:
+            if other.player_id != self.player_id:
+                action_table.damage(self, settings.collision_damage, other)
+        elif result == MOVE_COLLISION:
+            for robot in other:
                 if robot.player_id != self.player_id:
-                    robot.hp -= settings.collision_damage
-        except UnitBlockCollision as e:
-            if e.other_robot.player_id != self.player_id:
-                self.hp -= settings.collision_damage
-                e.other_robot.hp -= settings.collision_damage
-        except RobotException:
-            pass
+                    action_table.damage(robot, settings.collision_damage, self)
+        elif result == BLOCK_COLLISION:
+            if other.player_id != self.player_id:
+                action_table.damage(self, settings.collision_damage, other)
+                action_table.damage(other, settings.collision_damage, self)
 
     def call_attack(self, loc, action_table, damage=None):
         if damage is None:
-            damage = random.randint(*settings.attack_range)
-        try:
-            self.can_act(loc, action_table)
-        except UnitGuardCollision as e:
-            if e.other_robot.player_id != self.player_id:
-                e.other_robot.hp -= int(damage / 2)
-        except UnitMoveCollision as e:
-            for robot in e.other_robots:
+            damage = action_table.random.randint(*action_table.settings.attack_range)
+        result, other = self.can_act(loc, action_table)
+        action_table.collisions[result] += 1
+        if action_table.events is not None:
+            action_table.record_collision(self, 'attack', loc, result, other)
+        if result == GUARD_COLLISION:
+            if other.player_id != self.player_id:
+                action_table.damage(other, int(damage / 2), self)
+        elif result == MOVE_COLLISION:
+            for robot in other:
                 if robot.player_id != self.player_id:
-                    robot.hp -= damage
-        except UnitBlockCollision as e:
-            if e.other_robot.player_id != self.player_id:
-               e.other_robot.hp -= int(damage)
-        except RobotException:
-            pass
+                    action_table.damage(robot, damage, self)
+        elif result == BLOCK_COLLISION:
+            if other.player_id != self.player_id:
+                action_table.damage(other, int(damage), self)
 
     def call_suicide(self, action_table):
-        self.hp = 0
-        self.call_attack(self.location, action_table, damage=settings.suicide_damage)
+        damage = action_table.settings.suicide_damage
+        action_table.damage(self, self.hp, self)
+        self.call_attack(self.location, action_table, damage=damage)
         for loc in rg.locs_around(self.location):
-            self.call_attack(loc, action_table, damage=settings.suicide_damage)
+            self.call_attack(loc, action_table, damage=damage)
 
     @staticmethod
-    def is_valid_action(action):
-        global settings
-
+    def is_valid_action(action, settings=None):
+        # by the rules of the game being played, unless settings are given
+        if settings is None:
+            settings = rg.active().settings
         cmd, params = InternalRobot.parse_command(action)
+        if cmd == 'move' or cmd == 'attack':
+            return cmd in settings.valid_commands and len(params) > 0
         return cmd in settings.valid_commands
 
+class ActionTable(dict):
+    # maps each robot to its action for one turn, and settles every move
+    # at once from the positions at the start of the turn. a robot's move
+    # only ever depends on the robot standing on its target square, so the
+    # moves form chains that end in a free square, a blocked square or a
+    # cycle, and each robot is visited once.
+    def __init__(self, actions, field, rand=random, settings=None, events=None):
+        dict.__init__(self, actions)
+        self._field = field
+        self.random = rand
+        self.events = events
+        index = rg.active()
+        if settings is not None and settings is not index.settings:
+            index = rg.index_for(settings)
+        self.settings = index.settings
+        self.around = index.neighbours_table(('invalid', 'obstacle'))
+        self.targets = {}
+        self.movers = {}
+        self.moved = {}
+        self.damaged = set()
+        self.collisions = [0] * 5
+
+        for robot, action in self.iteritems():
+            cmd, params = InternalRobot.parse_command(action)
+            if cmd != 'move':
+                continue
+            if params[0] == robot.location or robot.movable_loc(params[0], self.around):
+                self.movers.setdefault(params[0], []).append(robot)
+                if params[0] != robot.location:
+                    self.targets[robot] = params[0]
+
+        self._next = {}
+        self._blocked = {}
+        for robot, loc in self.targets.iteritems():
+            self._blocked[robot], self._next[robot] = self.link(loc)
+        for robot in self.targets:
+            self.settle(robot)
+
+    def command(self, robot):
+        return self[robot][0]
+
+    def damage(self, robot, amount, source=None):
+        robot.hp -= amount
+        self.damaged.add(robot)
+        if self.events is not None:
+            self.events.emit('damage', robot=robot.robot_id, location=robot.location,
+                amount=amount, source=source.robot_id if source is not None else None)
+
+    def record_collision(self, robot, action, loc, result, other):
+        if result not in COLLISION_KINDS:
+            return
+        if result != MOVE_COLLISION:
+            other = [other]
+        self.events.emit('collision', robot=robot.robot_id, location=robot.location,
+            action=action, target=loc, kind=COLLISION_KINDS[result],
+            robots=[x.robot_id for x in other])
+
+    def link(self, loc):
+        # whether a move to loc is blocked outright, and the robot (if any)
+        # whose own move decides whether loc is vacated
+        blocked = len(self.movers[loc]) > 1
+        occupant = self._field[loc]
+        if occupant is None or self.command(occupant) == 'suicide':
+            return blocked, None
+        if occupant in self.targets:
+            return blocked, occupant
+        return True, None
+
+    def settle(self, robot):
+        path = []
+        on_path = set()
+        ok = True
+        # reaching a robot already on the path closes a cycle, which moves
+        while robot is not None and robot not in on_path:
+            if robot in self.moved:
+                ok = self.moved[robot]
+                break
+            path.append(robot)
+            on_path.add(robot)
+            if self._blocked[robot]:
+                ok = False
+                break
+            robot = self._next[robot]
+
+        for robot in path:
+            self.moved[robot] = ok
+
+    def vacates(self, robot, other):
+        if self.moved.get(robot, False):
+            return True
+        if not self._blocked.get(other, False):
+            return False
+        # seen from a contested robot, a cycle that only fails because of
+        # that robot still counts as moving away
+        while robot in self.targets and not self._blocked[robot]:
+            robot = self._next[robot]
+            if robot is other:
+                return True
+        return False
+
+class ReadOnlyDict(rg.ReadOnlyDict):
+    # the game info handed to user code, kept up to date by the engine
+    what = 'game info'
+
 # just to make things easier
 class Field:
     def __init__(self, size):
@@ -177,63 +381,282 @@ class Field:
     def __setitem__(self, point, v):
         self.field[point[1]][point[0]] = v
 
+class SparseField(dict):
+    # a Field for a handful of robots, without allocating the whole board
+    def __missing__(self, point):
+        return None
+
+class State:
+    # a compact copy of a game: the turn about to be played and
+    # location -> (hp, player_id) for every robot. forking copies one dict
+    # of tuples, so search code can branch thousands of times a turn, and
+    # simulate_turn plays a turn with the engine's own rules.
+    def __init__(self, turn, robots, random_state=None, order=None):
+        self.turn = turn
+        self.robots = robots
+        self.random_state = random_state
+        self._order = order
+
+    @staticmethod
+    def from_game_info(game_info):
+        return State(game_info['turn'], dict((loc, (info['hp'], info['player_id']))
+            for loc, info in game_info['robots'].iteritems()))
+
+    def fork(self):
+        return State(self.turn, dict(self.robots), self.random_state, self._order)
+
+    def order(self):
+        # robots act in spawn order when it is known, else by location
+        if self._order is not None:
+            return self._order
+        return sorted(self.robots)
+
+    def scores(self):
+        scores = [0, 0]
+        for hp, player_id in self.robots.itervalues():
+            scores[player_id] += 1
+        return scores
+
+    def simulate_turn(self, actions, rand=random):
+        # plays one turn with actions as location -> action; robots without
+        # a valid action guard. robots on spawn points are cleared on spawn
+        # turns as usual, but no new ones appear: where they spawn is random.
+        settings = rg.active().settings
+
+        field = SparseField()
+        robots = []
+        for loc in self.order():
+            hp, player_id = self.robots[loc]
+            robot = InternalRobot(loc, hp, player_id, field)
+            field[loc] = robot
+            robots.append(robot)
+
+        issued = {}
+        for robot in robots:
+            action = actions.get(robot.location)
+            if action is None or not InternalRobot.is_valid_action(action, settings):
+                action = ['guard']
+            issued[robot] = action
+        action_table = ActionTable(issued, field, rand, settings)
+        for robot in robots:
+            robot.issue_command(action_table[robot], action_table)
+
+        cleared = ()
+        if self.turn % settings.spawn_every == 0:
+            cleared = settings.spawn_coords
+        self.robots = dict((x.location, (x.hp, x.player_id)) for x in robots
+            if x.hp > 0 and x.location not in cleared)
+        self.turn += 1
+        self.random_state = None
+        self._order = None
+        return self
+
+class RobotStore:
+    # the robots in play, in spawn order, by id and by player. removing is
+    # O(1); the ordered lists drop removed robots the next time they are
+    # read, in one pass however many robots went.
+    def __init__(self):
+        self._by_id = {}
+        self._order = []
+        self._players = ([], [])
+        self._counts = [0, 0]
+        self._next_id = 0
+        self._removed = 0
+
+    def add(self, location, hp, player_id, field):
+        robot = InternalRobot(location, hp, player_id, field, self._next_id)
+        self._next_id += 1
+        self._by_id[robot.robot_id] = robot
+        self._order.append(robot)
+        self._players[player_id].append(robot)
+        self._counts[player_id] += 1
+        return robot
+
+    def remove(self, robot):
+        del self._by_id[robot.robot_id]
+        self._counts[robot.player_id] -= 1
+        self._removed += 1
+
+    def compact(self):
+        if self._removed:
+            alive = self._by_id
+            self._order = [x for x in self._order if x.robot_id in alive]
+            self._players = tuple([x for x in robots if x.robot_id in alive]
+                for robots in self._players)
+            self._removed = 0
+
+    def __iter__(self):
+        self.compact()
+        return iter(self._order)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __getitem__(self, robot_id):
+        return self._by_id[robot_id]
+
+    def __contains__(self, robot):
+        return self._by_id.get(robot.robot_id) is robot
+
+    def player_robots(self, player_id):
+        self.compact()
+        return list(self._players[player_id])
+
+    def count(self, player_id):
+        return self._counts[player_id]
+
 class Game:
-    def __init__(self, player1, player2, record_turns=False):
+    def __init__(self, player1, player2, record_turns=False, track_changes=True,
+            replay=None, seed=None, profiler=None, settings=None, error_log=None,
+            events=None):
+        # a game plays by the module level settings unless given its own,
+        # see make_settings; rg then follows its map while it plays a turn
+        self._map_index = None
+        if settings is not None:
+            self._map_index = rg.index_for(settings)
+        else:
+            settings = default_settings
+        self.settings = settings
         self._players = (player1, player2)
         self.turns = 0
-        self._robots = []
-        self._field = Field(settings.board_size)
+        self._profiler = profiler
+        if error_log is None:
+            error_log = errorlog.ErrorLog(max_reports=settings.max_error_reports)
+        self.error_log = error_log
+
+        # all of the engine's randomness comes from the game's own
+        # generator, so a seed, the bots and the map decide the whole game
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(31)
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._robots = RobotStore()
+        self._field = Field(self.settings.board_size)
         self._record = record_turns
         if self._record:
             self.history = [[] for i in range(2)]
-
-    def build_game_info(self):
-        global settings
-
-        return {
-            'robots': dict((
-                y.location,
-                dict((x, getattr(y, x)) for x in settings.exposed_properties)
-            ) for y in self._robots),
-            'turn': self.turns,
-        }
+        self._replay = replay
+        if self._replay is not None:
+            self._replay.write_header(self.settings.board_size, self.seed)
+        # an events.EventWriter to stream what happens each turn to
+        self._events = events
+
+        # the game info is kept up to date as robots change, rather than
+        # rebuilt every turn. with track_changes, it also carries the
+        # squares that changed since the previous turn, mapped to their
+        # new robot info or None if they were emptied.
+        self._track_changes = track_changes
+        self._robot_info = ReadOnlyDict()
+        self._game_info = ReadOnlyDict(robots=self._robot_info, turn=self.turns)
+        self._changes = {}
+
+    def get_game_info(self):
+        return self._game_info
+
+    def snapshot(self):
+        robots = list(self._robots)
+        return State(self.turns,
+            dict((x.location, (x.hp, x.player_id)) for x in robots),
+            self._random.getstate(), [x.location for x in robots])
+
+    def restore(self, state):
+        for robot in list(self._robots):
+            self._robots.remove(robot)
+            self._field[robot.location] = None
+            self.remove_robot_info(robot.location)
+        for loc in state.order():
+            hp, player_id = state.robots[loc]
+            robot = self._robots.add(loc, hp, player_id, self._field)
+            self._field[loc] = robot
+            self.update_robot_info(robot)
+        self.turns = state.turn
+        if state.random_state is not None:
+            self._random.setstate(state.random_state)
+
+    def fork(self, player1=None, player2=None):
+        # a game in the same state that records nothing, for playing out
+        # lines on the engine. it is not a faithful continuation: the
+        # players are new ones (guards unless given; never pass the
+        # original's, they would be shared), and game['robots'] lists the
+        # robots in spawn order, which bots that iterate it may notice
+        players = [x if x is not None else Player(robot=DefaultRobot())
+            for x in (player1, player2)]
+        settings = self.settings if self._map_index is not None else None
+        other = Game(*players, track_changes=self._track_changes,
+            seed=self.seed, settings=settings)
+        other.restore(self.snapshot())
+        return other
+
+    def update_robot_info(self, robot):
+        info = ReadOnlyDict((x, getattr(robot, x)) for x in self.settings.exposed_properties)
+        dict.__setitem__(self._robot_info, robot.location, info)
+        self._changes[robot.location] = info
+
+    def remove_robot_info(self, loc):
+        dict.__delitem__(self._robot_info, loc)
+        self._changes[loc] = None
+
+    def publish_game_info(self):
+        dict.__setitem__(self._game_info, 'turn', self.turns)
+        if self._track_changes:
+            dict.__setitem__(self._game_info, 'changes', ReadOnlyDict(self._changes))
+        self._changes = {}
+        return self._game_info
 
     def notify_new_turn(self):
-        for player_id in range(2):
-            user_robot = self._players[player_id].get_robot()
-            if hasattr(user_robot, 'on_new_turn'):
-                if inspect.ismethod(user_robot.on_new_turn):
-                    user_robot.on_new_turn()
+        for player in self._players:
+            player.notify_new_turn()
 
     def make_robots_act(self):
-        global settings
-
-        game_info = self.build_game_info()
+        game_info = self.publish_game_info()
+        self.error_log.turn = self.turns
         actions = {}
 
+        for player_id, player in enumerate(self._players):
+            robots = self._robots.player_robots(player_id)
+            actions.update(player.get_actions(robots, game_info, self._profiler,
+                self.error_log))
+            if self._profiler is not None:
+                self._profiler.lap('act', player_id)
+        issued = dict((robot.location, action) for robot, action in actions.iteritems())
+
+        events = self._events
+        if events is not None:
+            for robot in self._robots:
+                events.emit('action', robot=robot.robot_id, player_id=robot.player_id,
+                    location=robot.location, action=actions[robot])
+
+        action_table = ActionTable(actions, self._field, self._random, self.settings,
+            events)
+        moved = []
         for robot in self._robots:
-            user_robot = self._players[robot.player_id].get_robot()
-            for prop in settings.exposed_properties:
-                setattr(user_robot, prop, getattr(robot, prop))
-
-            try:
-                next_action = user_robot.act(game_info)
-                if not InternalRobot.is_valid_action(next_action):
-                    raise Exception('%s is not a valid action' % str(next_action))
-            except Exception:
-                print "The robot at (%s, %s) raised an exception:" % robot.location
-                print '-' * 60
-                traceback.print_exc(file=sys.stdout)
-                print '-' * 60
-                next_action = ['guard']
-            actions[robot] = next_action
-
-        for robot, action in actions.iteritems():
             old_loc = robot.location
-            robot.issue_command(action, actions)
+            robot.issue_command(action_table[robot], action_table)
             if robot.location != old_loc:
-                self._field[old_loc] = None
-                self._field[robot.location] = robot
+                moved.append((robot, old_loc))
+
+        if events is not None:
+            for robot, old_loc in moved:
+                events.emit('move', robot=robot.robot_id, to=robot.location,
+                    **{'from': old_loc})
+
+        for robot, old_loc in moved:
+            self._field[old_loc] = None
+            self.remove_robot_info(old_loc)
+        for robot, old_loc in moved:
+            self._field[robot.location] = robot
+            self.update_robot_info(robot)
+        for robot in action_table.damaged:
+            # a robot can move onto a square whose robot self-destructs
+            if self._field[robot.location] is robot:
+                self.update_robot_info(robot)
+
+        if self._profiler is not None:
+            collisions = action_table.collisions
+            self._profiler.record_collisions(collisions[GUARD_COLLISION],
+                collisions[BLOCK_COLLISION], collisions[MOVE_COLLISION])
+            self._profiler.lap('resolve')
+        return issued
 
     def robot_at_loc(self, loc):
         robot = self._field[loc]
@@ -243,64 +666,102 @@ class Game:
         if self.robot_at_loc(loc) is not None:
             return False
 
-        robot = InternalRobot(loc, settings.robot_hp, player_id, self._field)
-        self._robots.append(robot)
+        robot = self._robots.add(loc, self.settings.robot_hp, player_id, self._field)
         self._field[loc] = robot
+        self.update_robot_info(robot)
+        if self._events is not None:
+            self._events.emit('spawn', robot=robot.robot_id, player_id=player_id,
+                location=loc, hp=robot.hp)
 
     def spawn_robot_batch(self):
-        global settings
-
-        locs = random.sample(settings.spawn_coords, settings.spawn_per_player * 2)
+        locs = self._random.sample(self.settings.spawn_coords, self.settings.spawn_per_player * 2)
         for player_id in range(2):
-            for i in range(settings.spawn_per_player):
+            for i in range(self.settings.spawn_per_player):
                 self.spawn_robot(player_id, locs.pop())
 
     def clear_spawn_points(self):
-        for loc in settings.spawn_coords:
+        for loc in self.settings.spawn_coords:
             if self._field[loc] is not None:
+                if self._events is not None:
+                    self.record_death(self._field[loc], 'spawn')
                 self._robots.remove(self._field[loc])
                 self._field[loc] = None
+                self.remove_robot_info(loc)
 
     def remove_dead(self):
         to_remove = [x for x in self._robots if x.hp <= 0]
         for robot in to_remove:
+            if self._events is not None:
+                self.record_death(robot, 'damage')
             self._robots.remove(robot)
-            if self._field[robot.location] == robot:
+            if self._field[robot.location] is robot:
                 self._field[robot.location] = None
+                self.remove_robot_info(robot.location)
+
+    def record_death(self, robot, cause):
+        self._events.emit('death', robot=robot.robot_id, player_id=robot.player_id,
+            location=robot.location, cause=cause)
 
     def make_history(self):
         # indeed, let's hope this game does
-        global settings
-
         robots = [[] for i in range(2)]
         for robot in self._robots:
             robot_info = []
-            for prop in settings.exposed_properties:
+            for prop in self.settings.exposed_properties:
                 if prop != 'player_id':
                     robot_info.append(getattr(robot, prop))
             robots[robot.player_id].append(robot_info)
         return robots
 
     def run_turn(self):
-        global settings
+        rg.activate(self._map_index)
+        profiler = self._profiler
+        if profiler is not None:
+            profiler.start_turn()
+        if self._events is not None:
+            self._events.turn = self.turns
 
         self.notify_new_turn()
-        self.make_robots_act()
+        if profiler is not None:
+            profiler.lap('notify')
+        actions = self.make_robots_act()
         self.remove_dead()
+        if profiler is not None:
+            profiler.lap('remove_dead')
 
-        if self.turns % settings.spawn_every == 0:
+        if self.turns % self.settings.spawn_every == 0:
             self.clear_spawn_points()
             self.spawn_robot_batch()
+        if profiler is not None:
+            profiler.lap('spawn')
 
         if self._record:
             round_history = self.make_history()
             for i in (0, 1):
                 self.history[i].append(round_history[i])
+        if self._replay is not None:
+            self._replay.write_turn(self.turns, self._robots, actions)
+        if self._events is not None:
+            self._events.emit('turn', scores=self.get_scores())
+            self._events.end_turn()
+        if profiler is not None:
+            profiler.lap('record')
 
         self.turns += 1
 
+    def finished(self):
+        # the last turn was played, or a side has no robots left and no
+        # spawn turn is left to give it more. its opponent can no longer
+        # lose, but the outcome is not fixed: it could still self-destruct
+        # its last robots and turn the win into a draw. this ignores that,
+        # so stopping here may score a game differently than playing it out.
+        if self.turns >= self.settings.max_turns:
+            return True
+        spawn_every = self.settings.spawn_every
+        next_spawn = -(-self.turns // spawn_every) * spawn_every
+        if next_spawn < self.settings.max_turns:
+            return False
+        return 0 in self.get_scores()
+
     def get_scores(self):
-        scores = [0, 0]
-        for robot in self._robots:
-            scores[robot.player_id] += 1
-        return scores
+        return [self._robots.count(x) for x in range(2)]
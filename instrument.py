@@ -0,0 +1,139 @@
+import csv
+import json
+import timeit
+
+# opt-in measurements of where a game's time goes. pass a Profiler to
+# game.Game and it records wall time per turn phase and per player, every
+# robot's act() call, collisions and exceptions. without one the engine
+# only pays for a few `is not None` checks per turn.
+
+timer = timeit.default_timer
+
+PHASES = ('notify', 'act', 'resolve', 'remove_dead', 'spawn', 'record')
+COLLISIONS = ('guard', 'block', 'move')
+
+def player_stats():
+    return {
+        'act_time': 0.0,
+        'act_calls': 0,
+        'act_max': 0.0,
+        'exceptions': 0,
+        'turn_time': 0.0,
+    }
+
+class Profiler:
+    def __init__(self, names=('player0', 'player1')):
+        self.names = list(names)
+        self.turns = 0
+        self.phases = dict((x, 0.0) for x in PHASES)
+        self.players = [player_stats() for i in range(2)]
+        self.collisions = dict((x, 0) for x in COLLISIONS)
+        self._last = None
+
+    def start_turn(self):
+        self.turns += 1
+        self._last = timer()
+
+    def lap(self, phase, player_id=None):
+        now = timer()
+        elapsed = now - self._last
+        self._last = now
+        self.phases[phase] += elapsed
+        if player_id is not None:
+            self.players[player_id]['turn_time'] += elapsed
+
+    def record_act(self, player_id, elapsed):
+        player = self.players[player_id]
+        player['act_time'] += elapsed
+        player['act_calls'] += 1
+        player['act_max'] = max(player['act_max'], elapsed)
+
+    def record_exception(self, player_id):
+        self.players[player_id]['exceptions'] += 1
+
+    def add_player_stats(self, player_id, stats):
+        player = self.players[player_id]
+        player['act_time'] += float(stats['act_time'])
+        player['act_calls'] += int(stats['act_calls'])
+        player['act_max'] = max(player['act_max'], float(stats['act_max']))
+        player['exceptions'] += int(stats['exceptions'])
+
+    def record_collisions(self, guard, block, move):
+        self.collisions['guard'] += guard
+        self.collisions['block'] += block
+        self.collisions['move'] += move
+
+    def summary(self):
+        return {
+            'turns': self.turns,
+            'phases': dict(self.phases),
+            'names': list(self.names),
+            'players': [dict(x) for x in self.players],
+            'collisions': dict(self.collisions),
+        }
+
+def merge(summaries):
+    # phases and collisions add up over games, players by name
+    total = {
+        'games': 0,
+        'turns': 0,
+        'phases': dict((x, 0.0) for x in PHASES),
+        'players': {},
+        'collisions': dict((x, 0) for x in COLLISIONS),
+    }
+    for summary in summaries:
+        total['games'] += 1
+        total['turns'] += summary['turns']
+        for phase, elapsed in summary['phases'].iteritems():
+            total['phases'][phase] += elapsed
+        for name, other in zip(summary['names'], summary['players']):
+            player = total['players'].setdefault(name, player_stats())
+            for key, value in other.iteritems():
+                if key == 'act_max':
+                    player[key] = max(player[key], value)
+                else:
+                    player[key] += value
+        for kind, count in summary['collisions'].iteritems():
+            total['collisions'][kind] += count
+    return total
+
+def flatten(summary):
+    row = [('turns', summary['turns'])]
+    row.extend(('%s_time' % x, summary['phases'][x]) for x in PHASES)
+    for i, player in enumerate(summary['players']):
+        row.append(('player%d_name' % i, summary['names'][i]))
+        row.extend(('player%d_%s' % (i, key), player[key]) for key in sorted(player))
+    row.extend(('%s_collisions' % x, summary['collisions'][x]) for x in COLLISIONS)
+    return row
+
+def write_json(fileobj, summaries):
+    json.dump({'games': summaries, 'total': merge(summaries)}, fileobj,
+        indent=2, sort_keys=True)
+
+def write_csv(fileobj, summaries):
+    writer = csv.writer(fileobj)
+    for i, summary in enumerate(summaries):
+        row = flatten(summary)
+        if i == 0:
+            writer.writerow(['game'] + [x[0] for x in row])
+        writer.writerow([i] + [x[1] for x in row])
+
+def write_report(fname, summaries):
+    with open(fname, 'wb') as f:
+        if fname.endswith('.csv'):
+            write_csv(f, summaries)
+        else:
+            write_json(f, summaries)
+
+def print_report(total):
+    turns = max(total['turns'], 1)
+    print 'engine time per turn (ms):'
+    for phase in PHASES:
+        print '  %-12s %8.3f' % (phase, total['phases'][phase] * 1000 / turns)
+    for name, player in sorted(total['players'].iteritems()):
+        calls = max(player['act_calls'], 1)
+        print '%s: %d act() calls, %.3f ms avg, %.3f ms max, %d exceptions' % (
+            name, player['act_calls'], player['act_time'] * 1000 / calls,
+            player['act_max'] * 1000, player['exceptions'])
+    print 'collisions: %s' % ', '.join('%d %s' % (total['collisions'][x], x)
+        for x in COLLISIONS)
@@ -0,0 +1,340 @@
+import random
+###
+import numpy as np
+###
+import errorlog
+import game
+import rg
+
+# many games on one map, played in lockstep with their robots held in NumPy
+# arrays instead of InternalRobot objects. each turn is settled for all
+# games at once with the rules of game.ActionTable, so a game here plays
+# exactly like game.Game with the same seed and bots -- unless the bots
+# draw from the global random module, which the games now share.
+#
+# the robots of all games are kept in one set of flat arrays, ordered by
+# game and then by spawn order:
+#
+#   game    the game each robot is in
+#   loc     its square, as x * board_size + y
+#   hp      its hit points
+#   owner   its player id
+#
+# run_turn asks the players for their actions like Game does, with each
+# game's info kept up to date by the same sequence of changes Game makes
+# (bots that iterate over game['robots'] see the same order). step takes
+# the actions as arrays directly, for policies that work on the arrays;
+# without players there is no game info to keep. NumPy is only needed for
+# this module.
+
+GUARD, MOVE, ATTACK, SUICIDE = range(4)
+COMMANDS = {'guard': GUARD, 'move': MOVE, 'attack': ATTACK, 'suicide': SUICIDE}
+
+class LockstepGames:
+    def __init__(self, players=None, seeds=None, settings=None):
+        # players is a (player1, player2) pair per game; a player can only
+        # be in one game. without players, seeds says how many games.
+        self._map_index = None
+        if settings is not None:
+            self._map_index = rg.index_for(settings)
+        else:
+            settings = game.default_settings
+        self.settings = settings
+        self._players = None
+        if players is not None:
+            self._players = [tuple(x) for x in players]
+        elif seeds is None:
+            raise ValueError('need players or seeds')
+        self.games = len(self._players if seeds is None else seeds)
+        self.turns = 0
+
+        if seeds is None:
+            seeds = [random.SystemRandom().getrandbits(31) for x in self._players]
+        if self._players is not None and len(seeds) != len(self._players):
+            raise ValueError('need one seed per game')
+        self.seeds = list(seeds)
+        self._random = [random.Random(x) for x in self.seeds]
+        self.error_logs = [errorlog.ErrorLog(max_reports=settings.max_error_reports)
+            for x in range(self.games)]
+
+        size = settings.board_size
+        self._cells = size * size
+        self._locs = [(x, y) for x in range(size) for y in range(size)]
+        self._cell = dict((loc, i) for i, loc in enumerate(self._locs))
+        # the walkable squares around each square, -1 padded
+        index = self._map_index or rg.active()
+        around = index.neighbours_table(('invalid', 'obstacle'))
+        self._around = np.full((self._cells, 4), -1, dtype=np.int64)
+        for loc, locs in around.iteritems():
+            self._around[self._cell[loc], :len(locs)] = [self._cell[x] for x in locs]
+        self._spawn = np.zeros(self._cells, dtype=bool)
+        self._spawn[[self._cell[x] for x in settings.spawn_coords]] = True
+
+        self.game = np.zeros(0, dtype=np.int64)
+        self.loc = np.zeros(0, dtype=np.int64)
+        self.hp = np.zeros(0, dtype=np.int64)
+        self.owner = np.zeros(0, dtype=np.int64)
+
+        self._robot_info = None
+        if self._players is not None:
+            self._robot_info = [game.ReadOnlyDict() for x in range(self.games)]
+            self._changes = [{} for x in range(self.games)]
+
+    def bounds(self):
+        # where each game's robots start and end in the arrays
+        return np.searchsorted(self.game, np.arange(self.games + 1))
+
+    def robots(self, g):
+        # (location, hp, player_id) of game g's robots, in spawn order
+        start, end = self.bounds()[g:g + 2]
+        return [(self._locs[loc], hp, owner) for loc, hp, owner in zip(
+            self.loc[start:end].tolist(), self.hp[start:end].tolist(),
+            self.owner[start:end].tolist())]
+
+    def get_scores(self):
+        counts = np.bincount(self.game * 2 + self.owner, minlength=self.games * 2)
+        return counts.reshape(self.games, 2).tolist()
+
+    def update_robot_info(self, robots):
+        # robots are indexes into the arrays
+        exposed = self.settings.exposed_properties
+        for i in robots.tolist():
+            g, loc = self.game[i], self._locs[self.loc[i]]
+            robot = game.InternalRobot(loc, int(self.hp[i]), int(self.owner[i]), None)
+            info = game.ReadOnlyDict((x, getattr(robot, x)) for x in exposed)
+            dict.__setitem__(self._robot_info[g], loc, info)
+            self._changes[g][loc] = info
+
+    def remove_robot_info(self, games, cells):
+        for g, cell in zip(games.tolist(), cells.tolist()):
+            dict.__delitem__(self._robot_info[g], self._locs[cell])
+            self._changes[g][self._locs[cell]] = None
+
+    def publish_game_info(self, g):
+        game_info = game.ReadOnlyDict(robots=self._robot_info[g], turn=self.turns,
+            changes=game.ReadOnlyDict(self._changes[g]))
+        self._changes[g] = {}
+        return game_info
+
+    def ask_players(self):
+        # the actions of every robot, in the order of the arrays
+        cmd = np.zeros(len(self.loc), dtype=np.int64)
+        target = np.full(len(self.loc), -1, dtype=np.int64)
+        bounds = self.bounds().tolist()
+        robots = [game.InternalRobot(self._locs[loc], hp, player_id, None)
+            for loc, hp, player_id in zip(self.loc.tolist(), self.hp.tolist(),
+                self.owner.tolist())]
+
+        for g, players in enumerate(self._players):
+            internal = robots[bounds[g]:bounds[g + 1]]
+            game_info = self.publish_game_info(g)
+            error_log = self.error_logs[g]
+            error_log.turn = self.turns
+
+            for player in players:
+                player.notify_new_turn()
+            actions = {}
+            for player_id, player in enumerate(players):
+                actions.update(player.get_actions(
+                    [x for x in internal if x.player_id == player_id],
+                    game_info, error_log=error_log))
+
+            for i, robot in enumerate(internal, bounds[g]):
+                cmd[i], target[i] = self.encode(actions[robot])
+        return cmd, target
+
+    def encode(self, action):
+        # the engine only takes tuples as locations
+        cmd, params = game.InternalRobot.parse_command(action)
+        cmd = COMMANDS.get(cmd, GUARD)
+        if cmd in (MOVE, ATTACK):
+            try:
+                if isinstance(params[0], tuple):
+                    return cmd, self._cell.get(params[0], -1)
+            except (IndexError, TypeError):
+                pass
+        return cmd, -1
+
+    def run_turn(self):
+        rg.activate(self._map_index)
+        cmd, target = self.ask_players()
+        self.step(cmd, target)
+
+    def run(self):
+        while self.turns < self.settings.max_turns:
+            self.run_turn()
+
+    def step(self, cmd, target):
+        # plays a turn with cmd and target (a square, or -1) per robot
+        cmd = np.asarray(cmd, dtype=np.int64)
+        target = np.asarray(target, dtype=np.int64)
+        overrun = None
+        if len(self.loc):
+            overrun = self.resolve(cmd, target, self.attack_damage(cmd))
+        self.remove_dead(overrun)
+        if self.turns % self.settings.spawn_every == 0:
+            self.clear_spawn_points()
+            self.spawn_robot_batch()
+        self.turns += 1
+
+    def attack_damage(self, cmd):
+        # drawn from each game's generator in the order its robots act,
+        # like ActionTable does, so the games keep to their seeds
+        low, high = self.settings.attack_range
+        damage = np.zeros(len(cmd), dtype=np.int64)
+        attackers = np.flatnonzero(cmd == ATTACK)
+        rands = self._random
+        damage[attackers] = [rands[g].randint(low, high)
+            for g in self.game[attackers].tolist()]
+        return damage
+
+    def resolve(self, cmd, target, damage):
+        settings = self.settings
+        n = len(self.loc)
+        ids = np.arange(n)
+        base = self.game * self._cells
+        cell = base + self.loc
+
+        valid = (target[:, None] == self._around[self.loc]).any(axis=1) & (target >= 0)
+        real = (cmd == MOVE) & valid
+        stay = (cmd == MOVE) & (target == self.loc)
+        mover = real | stay
+        occupant = np.full(self.games * self._cells, -1, dtype=np.int64)
+        occupant[cell] = ids
+        dest = base + np.where(mover, target, self.loc)
+        movers = np.bincount(dest[mover], minlength=len(occupant))
+
+        # the chains of ActionTable.link and settle. first is the first
+        # blocked robot down a robot's chain, n if there is none: the chain
+        # ends on a free square or in a cycle and the move goes through.
+        held = occupant[dest]
+        held_safe = np.where(held >= 0, held, 0)
+        waits = real & (held >= 0)
+        blocked = real & ((movers[dest] > 1) |
+            (waits & (cmd[held_safe] != SUICIDE) & ~real[held_safe]))
+        chain = np.append(np.where(waits & real[held_safe], held, n), n)
+        first = np.append(np.where(blocked, ids, np.where(chain[:n] == n, n, -2)), n)
+        for i in range(n.bit_length() + 1):
+            unknown = first == -2
+            if not unknown.any():
+                break
+            first = np.where(unknown, first[chain], first)
+            chain = chain[chain]
+        first[first == -2] = n
+        first = first[:n]
+        moved = real & (first == n)
+
+        # every call to can_act: a move, an attack or one square of a
+        # suicide, as actor, square, damage
+        suicides = np.flatnonzero(cmd == SUICIDE)
+        around = self._around[self.loc[suicides]]
+        moves = np.flatnonzero(real)
+        attacks = np.flatnonzero((cmd == ATTACK) & valid)
+        actor = np.concatenate((moves, attacks, np.repeat(suicides, 4)[around.ravel() >= 0]))
+        square = base[actor] + np.concatenate((target[moves], target[attacks],
+            around[around >= 0]))
+        is_move = np.arange(len(actor)) < len(moves)
+        amount = np.where(is_move, settings.collision_damage, np.concatenate((
+            np.zeros(len(moves), dtype=np.int64), damage[attacks],
+            np.full((around >= 0).sum(), settings.suicide_damage, dtype=np.int64))))
+
+        other = occupant[square]
+        present = other >= 0
+        other = np.where(present, other, 0)
+        present &= ~stay[other]
+        other_cmd = cmd[other]
+        vacates = moved[other] | (blocked[actor] & (first[other] == actor))
+        guard_collision = present & (other_cmd == GUARD)
+        block_collision = present & ((other_cmd == ATTACK) |
+            ((other_cmd == MOVE) & ~vacates))
+        rest = ~(guard_collision | block_collision)
+        move_collision = rest & (movers[square] - is_move > 0)
+        free = rest & ~move_collision
+        enemy = present & (self.owner[other] != self.owner[actor])
+
+        loss = np.zeros(n, dtype=np.int64)
+        hit = np.zeros(n, dtype=bool)
+        def damage_robots(robots, amounts):
+            np.add.at(loss, robots, amounts)
+            hit[robots] = True
+
+        bumped = is_move & (guard_collision | block_collision) & enemy
+        damage_robots(actor[bumped], settings.collision_damage)
+        damage_robots(other[is_move & block_collision & enemy], settings.collision_damage)
+        struck = ~is_move & guard_collision & enemy
+        damage_robots(other[struck], amount[struck] // 2)
+        struck = ~is_move & block_collision & enemy
+        damage_robots(other[struck], amount[struck])
+
+        # robots moving into a square take the damage of every enemy that
+        # collides there, whether moving in too or attacking it
+        size = len(occupant)
+        key = self.owner[actor[move_collision]] * size + square[move_collision]
+        pool = np.bincount(key, amount[move_collision], minlength=2 * size)
+        count = np.bincount(key, minlength=2 * size)
+        victims = np.flatnonzero(mover)
+        key = (1 - self.owner[victims]) * size + dest[victims]
+        damage_robots(victims[count[key] > 0], pool[key][count[key] > 0].astype(np.int64))
+
+        damage_robots(suicides, self.hp[suicides])
+
+        going = actor[is_move & free]
+        self.loc[going] = target[going]
+        self.hp -= loss
+
+        # robots that self-destructed under a robot moving onto their square
+        stayed = np.ones(n, dtype=bool)
+        stayed[going] = False
+        entered = np.zeros(len(occupant), dtype=bool)
+        entered[base[going] + self.loc[going]] = True
+        overrun = stayed & entered[cell]
+
+        if self._robot_info is not None:
+            # as in Game.make_robots_act; replacing the info of a robot that
+            # stayed puts nothing new in the dict, so doing it first is the
+            # same, and the robot moving in gets the square after
+            self.update_robot_info(np.flatnonzero(hit & stayed))
+            self.remove_robot_info(self.game[going], cell[going] - base[going])
+            self.update_robot_info(going)
+        return overrun
+
+    def keep(self, alive):
+        self.game = self.game[alive]
+        self.loc = self.loc[alive]
+        self.hp = self.hp[alive]
+        self.owner = self.owner[alive]
+
+    def remove_dead(self, overrun=None):
+        dead = self.hp <= 0
+        if self._robot_info is not None:
+            gone = dead if overrun is None else dead & ~overrun
+            self.remove_robot_info(self.game[gone], self.loc[gone])
+        self.keep(~dead)
+
+    def clear_spawn_points(self):
+        cleared = self._spawn[self.loc]
+        if self._robot_info is not None:
+            self.remove_robot_info(self.game[cleared], self.loc[cleared])
+        self.keep(~cleared)
+
+    def spawn_robot_batch(self):
+        settings = self.settings
+        count = settings.spawn_per_player
+        locs = []
+        for rand in self._random:
+            sample = rand.sample(settings.spawn_coords, count * 2)
+            sample.reverse()
+            locs.extend(self._cell[x] for x in sample)
+        games = np.repeat(np.arange(self.games), count * 2)
+        locs = np.array(locs, dtype=np.int64)
+
+        # new robots go after each game's robots, player 0's first
+        order = np.argsort(np.concatenate((self.game, games)), kind='mergesort')
+        self.game = np.concatenate((self.game, games))[order]
+        self.loc = np.concatenate((self.loc, locs))[order]
+        self.hp = np.concatenate((self.hp,
+            np.full(len(locs), settings.robot_hp, dtype=np.int64)))[order]
+        self.owner = np.concatenate((self.owner,
+            np.tile(np.repeat([0, 1], count), self.games)))[order]
+        if self._robot_info is not None:
+            self.update_robot_info(np.argsort(order)[len(order) - len(locs):])
@@ -0,0 +1,238 @@
+import array
+import ast
+import collections
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+###
+from settings import settings
+
+# maps are compiled once into a binary artifact and cached on disk under
+# the hash of their source, so later runs and every batch worker just map
+# the file instead of parsing the map and rebuilding its indexes. an
+# artifact holds
+#
+#   header      magic, version, board size, spawn count, walkable count
+#   types       one byte per square, SPAWN | OBSTACLE bits
+#   index       per square, its number among the walkable squares or -1,
+#               32 bits so every square of a 255 board can be walkable
+#   spawn       spawn points in map order (games sample from this order)
+#   neighbours  per walkable square, the numbers of its 4 walkable
+#               neighbours or -1. rg takes its square types and walkable
+#               neighbour lists from here and the types section
+#   distances   walking distance between every pair of walkable squares,
+#               UNREACHABLE if there is no path. left out for maps of more
+#               than MAX_DISTANCE_SQUARES walkable squares, whose table
+#               would grow with the square of that; rg then searches per
+#               target instead
+#
+# all arrays are little-endian and read in place with struct.
+
+MAGIC = 'RGMP'
+VERSION = 2
+
+HEADER = struct.Struct('<4sBHHH')
+SPAWN, OBSTACLE = 1, 2
+UNREACHABLE = 0xffff
+MAX_DISTANCE_SQUARES = 2500
+OFFSETS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+
+def cache_dir():
+    return os.path.expanduser(settings.map_cache_dir)
+
+def validate(map_data, board_size):
+    for key in ('spawn', 'obstacle'):
+        if key not in map_data:
+            raise ValueError('map has no %s list' % key)
+        for loc in map_data[key]:
+            if (len(loc) != 2 or not all(isinstance(x, int) for x in loc) or
+                    not all(0 <= x < board_size for x in loc)):
+                raise ValueError('bad %s location %r' % (key, loc))
+    spawn = [tuple(x) for x in map_data['spawn']]
+    if len(set(spawn)) != len(spawn):
+        raise ValueError('duplicate spawn locations')
+    if set(spawn) & set(tuple(x) for x in map_data['obstacle']):
+        raise ValueError('spawn locations on obstacles')
+
+def to_bytes(arr):
+    if struct.pack('=H', 1) != struct.pack('<H', 1):
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tostring()
+
+def compile_map(map_data, board_size):
+    if not 0 < board_size < 256:
+        raise ValueError('board size must be between 1 and 255')
+    validate(map_data, board_size)
+    spawn = [tuple(x) for x in map_data['spawn']]
+    obstacles = set(tuple(x) for x in map_data['obstacle'])
+
+    types = array.array('B', [0] * board_size ** 2)
+    index = array.array('i', [-1] * board_size ** 2)
+    walkable = []
+    for x in range(board_size):
+        for y in range(board_size):
+            if (x, y) in obstacles:
+                types[x * board_size + y] |= OBSTACLE
+            else:
+                index[x * board_size + y] = len(walkable)
+                walkable.append((x, y))
+    for x, y in spawn:
+        types[x * board_size + y] |= SPAWN
+
+    neighbours = array.array('i')
+    for x, y in walkable:
+        for dx, dy in OFFSETS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < board_size and 0 <= ny < board_size:
+                neighbours.append(index[nx * board_size + ny])
+            else:
+                neighbours.append(-1)
+
+    # a breadth first search from every walkable square
+    count = len(walkable)
+    distances = array.array('H')
+    if count > MAX_DISTANCE_SQUARES:
+        adjacent = []
+    else:
+        adjacent = [[n for n in neighbours[i * 4:i * 4 + 4] if n >= 0]
+            for i in range(count)]
+    for source in range(len(adjacent)):
+        row = [UNREACHABLE] * count
+        row[source] = 0
+        queue = collections.deque([source])
+        while queue:
+            i = queue.popleft()
+            d = row[i] + 1
+            for n in adjacent[i]:
+                if row[n] == UNREACHABLE:
+                    row[n] = d
+                    queue.append(n)
+        distances.extend(row)
+
+    spawn_arr = array.array('B')
+    for loc in spawn:
+        spawn_arr.extend(loc)
+    return ''.join([HEADER.pack(MAGIC, VERSION, board_size, len(spawn), count)] +
+        [to_bytes(x) for x in (types, index, spawn_arr, neighbours, distances)])
+
+class CompiledMap:
+    def __init__(self, data, path=None):
+        self._data = data
+        self.path = path
+
+        magic, version, self.board_size, spawn_count, self.walkable_count = \
+            HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a compiled map')
+
+        squares = self.board_size ** 2
+        self._types = HEADER.size
+        self._index = self._types + squares
+        spawn = self._index + squares * 4
+        self._neighbours = spawn + spawn_count * 2
+        self._distances = self._neighbours + self.walkable_count * 16
+        self.has_distances = len(data) == self._distances + self.walkable_count ** 2 * 2
+        if not self.has_distances and (len(data) != self._distances or
+                self.walkable_count <= MAX_DISTANCE_SQUARES):
+            raise ValueError('truncated compiled map')
+
+        coords = struct.unpack_from('<%dB' % (spawn_count * 2), data, spawn)
+        self.spawn = zip(coords[::2], coords[1::2])
+        types = self.all_types()
+        self.obstacles = [divmod(i, self.board_size)
+            for i, t in enumerate(types) if t & OBSTACLE]
+
+    def __reduce__(self):
+        if self.path is None:
+            return (CompiledMap, (self._data,))
+        return (open_map, (self.path,))
+
+    def cell_index(self, loc):
+        x, y = loc
+        if not (0 <= x < self.board_size and 0 <= y < self.board_size):
+            return -1
+        return struct.unpack_from('<i', self._data,
+            self._index + (x * self.board_size + y) * 4)[0]
+
+    def cell_types(self, loc):
+        x, y = loc
+        return struct.unpack_from('<B', self._data,
+            self._types + x * self.board_size + y)[0]
+
+    def all_types(self):
+        # the types of every square, x major
+        return struct.unpack_from('<%dB' % self.board_size ** 2, self._data,
+            self._types)
+
+    def neighbours(self, index):
+        return [x for x in struct.unpack_from('<4i', self._data,
+            self._neighbours + index * 16) if x >= 0]
+
+    def all_neighbours(self):
+        # the neighbour section in one read, 4 numbers per walkable square
+        return struct.unpack_from('<%di' % (self.walkable_count * 4), self._data,
+            self._neighbours)
+
+    def distance_row(self, index):
+        if not self.has_distances:
+            raise ValueError('map has no distance table')
+        return struct.unpack_from('<%dH' % self.walkable_count, self._data,
+            self._distances + index * self.walkable_count * 2)
+
+    def distance(self, loc1, loc2):
+        # walking distance, or None if there is no path or either end is
+        # not walkable
+        if not self.has_distances:
+            raise ValueError('map has no distance table')
+        i, j = self.cell_index(loc1), self.cell_index(loc2)
+        if i < 0 or j < 0:
+            return None
+        d = struct.unpack_from('<H', self._data,
+            self._distances + (i * self.walkable_count + j) * 2)[0]
+        return None if d == UNREACHABLE else d
+
+def open_map(path):
+    with open(path, 'rb') as f:
+        return CompiledMap(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), path)
+
+def store(key, data):
+    # write to a temporary file and rename, so concurrent workers never
+    # see half an artifact
+    directory = cache_dir()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    path = os.path.join(directory, key + '.rgm')
+    os.rename(tmp, path)
+    return path
+
+def load(source, board_size, parse):
+    key = hashlib.sha1('%d:%d:%s' % (VERSION, board_size, source)).hexdigest()
+    path = os.path.join(cache_dir(), key + '.rgm')
+    try:
+        return open_map(path)
+    except (IOError, OSError, ValueError, struct.error):
+        # missing, stale or cut short: compile it again
+        pass
+
+    data = compile_map(parse(source), board_size)
+    try:
+        return open_map(store(key, data))
+    except (IOError, OSError):
+        # no usable cache directory, keep the artifact in memory
+        return CompiledMap(data)
+
+def load_file(map_file, board_size=None):
+    return load(open(map_file, 'rb').read(), board_size or settings.board_size,
+        ast.literal_eval)
+
+def load_data(map_data, board_size=None):
+    source = repr(([tuple(x) for x in map_data['spawn']],
+        sorted(tuple(x) for x in map_data['obstacle'])))
+    return load(source, board_size or settings.board_size,
+        lambda x: map_data)
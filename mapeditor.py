@@ -39,15 +39,15 @@ Other functions
 '''
 
 class MapEditor:
-    def __init__(self, settings.board_size, blocksize, padding):
-        self._settings.board_size = settings.board_size
+    def __init__(self, board_size, blocksize, padding):
+        self._board_size = board_size
         self._blocksize = blocksize
         self._padding = padding
         self.make_canvas()
 
     def make_canvas(self):
         root = Tkinter.Tk()
-        size = (self._blocksize + self._padding) * self._settings.board_size + self._padding * 2 + 40
+        size = (self._blocksize + self._padding) * self._board_size + self._padding * 2 + 40
 
         self._canvas = Tkinter.Canvas(root, width=size, height=size)
         self._rect_items = []
@@ -63,8 +63,8 @@ class MapEditor:
         root.mainloop()
 
     def prepare_backdrop(self, size):
-        for y in range(self._settings.board_size):
-            for x in range(self._settings.board_size):
+        for y in range(self._board_size):
+            for x in range(self._board_size):
                 item = self._canvas.create_rectangle(
                     x * (self._blocksize + self._padding) + self._padding + 20, y * (self._blocksize + self._padding) + self._padding + 20,
                     (x+1) * (self._blocksize + self._padding) + 20, (y+1) * (self._blocksize + self._padding) + 20,
@@ -125,7 +125,7 @@ class MapEditor:
 
         for i, color in enumerate(self._colors):
             if color in label_mapping and label_mapping[color] is not None:
-                coords[label_mapping[color]].append((i % self._settings.board_size, int(i / self._settings.board_size)))
+                coords[label_mapping[color]].append((i % self._board_size, int(i / self._board_size)))
         print coords
 
     def invert_colors(self):
@@ -0,0 +1,185 @@
+import argparse
+import os
+import random
+import time
+
+# generates symmetric maps in bulk and screens them, for tournaments that
+# need many fair maps:
+#
+#   python mapgen.py -n 5000 -k 20 -o maps/generated
+#
+# a candidate is the default map's disc with obstacles scattered inside it
+# in symmetric groups, so every square has its mirror images. the disc's
+# edge holds the spawn points. a candidate passes if every walkable square
+# is connected to the centre, and if the walking distances from the spawn
+# points to the centre differ by at most max_spread. both players spawn on
+# random points of the same edge, so a narrow spread means no draw is much
+# luckier than another.
+#
+# the analysis is a breadth-first search on bitboards: a map is a python
+# integer with a bit per square, and one step of the search grows the
+# frontier in all four directions over the whole board with a few shifts
+# and masks. a row is board_size + 1 bits wide, the last bit always clear,
+# so a shift to the side never wraps around onto the next row.
+
+SYMMETRIES = {
+    'rotate': lambda n, x, y: [(n - 1 - x, n - 1 - y)],
+    'mirror': lambda n, x, y: [(n - 1 - x, y)],
+    'both': lambda n, x, y: [(n - 1 - x, y), (x, n - 1 - y), (n - 1 - x, n - 1 - y)],
+}
+
+def disc(board_size):
+    # the default map's shape: the squares inside the circle are walkable,
+    # those along its edge are spawn points
+    center = (board_size - 1) / 2.0
+    radius = (center - 0.5) ** 2
+    def inside(x, y):
+        return (x - center) ** 2 + (y - center) ** 2 <= radius
+
+    spawn, normal, obstacles = [], [], []
+    for x in range(board_size):
+        for y in range(board_size):
+            if not inside(x, y):
+                obstacles.append((x, y))
+            elif all(inside(x + dx, y + dy)
+                    for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))):
+                normal.append((x, y))
+            else:
+                spawn.append((x, y))
+    return spawn, normal, obstacles
+
+def orbits(locs, board_size, symmetry):
+    # the squares grouped with their mirror images
+    images = SYMMETRIES[symmetry]
+    seen = set()
+    groups = []
+    for x, y in locs:
+        if (x, y) in seen:
+            continue
+        group = set([(x, y)] + images(board_size, x, y))
+        seen.update(group)
+        groups.append(sorted(group))
+    return groups
+
+_layouts = {}
+
+def layout(board_size, symmetry):
+    key = (board_size, symmetry)
+    if key not in _layouts:
+        spawn, normal, obstacles = disc(board_size)
+        # the centre is never blocked, and on even boards its images are
+        # other squares, so every group holding it is left out
+        center = (int(board_size / 2), int(board_size / 2))
+        groups = [x for x in orbits(normal, board_size, symmetry) if center not in x]
+        _layouts[key] = (sorted(spawn), obstacles, groups, len(normal))
+    return _layouts[key]
+
+def generate(board_size, density, symmetry, rand):
+    spawn, obstacles, groups, normal = layout(board_size, symmetry)
+    groups = list(groups)
+    rand.shuffle(groups)
+    blocked = []
+    for group in groups:
+        if len(blocked) >= density * normal:
+            break
+        blocked.extend(group)
+    return {'spawn': spawn, 'obstacle': sorted(obstacles + blocked)}
+
+def bitboard(locs, board_size):
+    width = board_size + 1
+    bits = 0
+    for x, y in locs:
+        bits |= 1 << (y * width + x)
+    return bits
+
+def analyze(map_data, board_size):
+    width = board_size + 1
+    row = (1 << board_size) - 1
+    board = 0
+    for y in range(board_size):
+        board |= row << (y * width)
+    walkable = board & ~bitboard(map_data['obstacle'], board_size)
+    spawn = bitboard(map_data['spawn'], board_size) & walkable
+    center = bitboard([(int(board_size / 2), int(board_size / 2))], board_size)
+
+    distances = []
+    reached = frontier = center & walkable
+    distance = 0
+    while frontier:
+        distance += 1
+        frontier = ((frontier << 1) | (frontier >> 1) | (frontier << width) |
+            (frontier >> width)) & walkable & ~reached
+        reached |= frontier
+        count = bin(frontier & spawn).count('1')
+        distances.extend([distance] * count)
+
+    return {
+        'connected': reached == walkable and walkable != 0,
+        'spawn_count': bin(spawn).count('1'),
+        'unreachable_spawns': bin(spawn & ~reached).count('1'),
+        'min_distance': min(distances) if distances else None,
+        'max_distance': max(distances) if distances else None,
+        'mean_distance': float(sum(distances)) / len(distances) if distances else None,
+        'spread': max(distances) - min(distances) if distances else None,
+    }
+
+def passes(stats, max_spread, min_spawns):
+    return (stats['connected'] and stats['unreachable_spawns'] == 0 and
+        stats['spawn_count'] >= min_spawns and stats['spread'] <= max_spread)
+
+def screen(candidates, board_size, max_spread, min_spawns):
+    # (map, stats) of the candidates that pass, most even first
+    kept = []
+    for map_data in candidates:
+        stats = analyze(map_data, board_size)
+        if passes(stats, max_spread, min_spawns):
+            kept.append((map_data, stats))
+    kept.sort(key=lambda x: x[1]['spread'])
+    return kept
+
+def write_map(path, map_data, board_size, stats):
+    # the format game.init_settings loads; the board size is only noted,
+    # settings.board_size has to match it
+    with open(path, 'w') as f:
+        f.write('# %dx%d, spawn distance to centre %d-%d\n' % (board_size,
+            board_size, stats['min_distance'], stats['max_distance']))
+        f.write(repr({'spawn': map_data['spawn'], 'obstacle': map_data['obstacle']}))
+        f.write('\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate and screen symmetric maps.')
+    parser.add_argument('-n', '--candidates', type=int, default=1000,
+        help='number of maps to generate')
+    parser.add_argument('-k', '--keep', type=int, default=10,
+        help='number of passing maps to write')
+    parser.add_argument('-b', '--board-size', type=int, default=19)
+    parser.add_argument('-d', '--density', type=float, default=0.15,
+        help='share of the disc inside the spawn edge to block')
+    parser.add_argument('--symmetry', choices=sorted(SYMMETRIES), default='rotate')
+    parser.add_argument('--max-spread', type=int, default=3,
+        help='largest allowed difference between spawn distances to the centre')
+    parser.add_argument('--min-spawns', type=int, default=20,
+        help='fewest spawn points a map may have')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('-o', '--out', default='maps/generated', metavar='DIR')
+    args = parser.parse_args(argv)
+
+    rand = random.Random(args.seed)
+    began = time.time()
+    candidates = [generate(args.board_size, args.density, args.symmetry, rand)
+        for i in range(args.candidates)]
+    kept = screen(candidates, args.board_size, args.max_spread, args.min_spawns)
+    elapsed = time.time() - began
+    print '%d of %d maps passed (%.0f maps/sec)' % (len(kept), len(candidates),
+        len(candidates) / elapsed)
+
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    for i, (map_data, stats) in enumerate(kept[:args.keep]):
+        path = os.path.join(args.out, 'gen%d-%04d.py' % (args.board_size, i))
+        write_map(path, map_data, args.board_size, stats)
+        print '%s: spawn distance %d-%d, mean %.1f' % (path,
+            stats['min_distance'], stats['max_distance'], stats['mean_distance'])
+
+if __name__ == '__main__':
+    main()
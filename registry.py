@@ -0,0 +1,47 @@
+import hashlib
+import imp
+import os
+
+# bot code is compiled once per distinct source and kept here by content
+# hash. every game still runs the code in a fresh module, so module level
+# state never leaks from one game into the next, but the compiling is
+# paid for once per bot instead of once per game. worker processes forked
+# after a bot was compiled inherit its code object.
+
+_code = {}
+_sources = {}
+
+def code_hash(code):
+    return hashlib.sha1(code).hexdigest()
+
+def compile_code(code):
+    key = code_hash(code)
+    try:
+        return _code[key]
+    except KeyError:
+        compiled = _code[key] = compile(code, '<usercode>', 'exec')
+        return compiled
+
+def new_module(code):
+    mod = imp.new_module('usercode_%s' % code_hash(code)[:12])
+    exec compile_code(code) in mod.__dict__
+    return mod
+
+def release_module(mod):
+    # functions and classes defined by the bot refer back to the module's
+    # dict; clearing it breaks those cycles so the module goes away as soon
+    # as the game drops it
+    mod.__dict__.clear()
+
+def read_bot(fname):
+    # source of a bot file, reread only when the file changes
+    stat = os.stat(fname)
+    key = os.path.abspath(fname)
+    cached = _sources.get(key)
+    if cached is None or cached[0] != (stat.st_mtime, stat.st_size):
+        cached = _sources[key] = ((stat.st_mtime, stat.st_size), open(fname).read())
+    return cached[1]
+
+def clear():
+    _code.clear()
+    _sources.clear()
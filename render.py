@@ -1,23 +1,52 @@
 import Tkinter
 import game
 
+# the viewer only reads frames (see frames.py), so a slow game never blocks
+# it. controls:
+#
+#   space        pause / play
+#   left, right  step one turn back / forward (and pause)
+#   home, end    go to the first / latest turn
+#   f            fast-forward: play several turns per tick, painting only
+#                the last of them
+#   slider       seek to any turn played so far
+
+FAST_FORWARD = (1, 4, 16)
+
 class Render:
-    def __init__(self, game_inst, settings, block_size=20):
+    def __init__(self, source, settings, block_size=20):
         self._settings = settings
         self._blocksize = block_size
         self._winsize = block_size * self._settings.board_size + 40
-        self._game = game_inst
+        self._source = source
         self._colors = game.Field(self._settings.board_size)
+        self._squares = game.Field(self._settings.board_size)
+        self._robot_colors = {}
+
+        self._position = 0
+        self._shown = None
+        self._playing = True
+        self._speed = 0
 
         self._master = Tkinter.Tk()
         self._master.title('robot game')
         self._win = Tkinter.Canvas(self._master, width=self._winsize, height=self._winsize + self._blocksize * 7/4)
         self._win.pack()
+        self._slider = Tkinter.Scale(self._master, orient=Tkinter.HORIZONTAL,
+            from_=0, to=self._source.total - 1, showvalue=0, command=self.on_seek)
+        self._slider.pack(fill=Tkinter.X)
 
         self.prepare_backdrop(self._win)
         self._label = self._win.create_text(self._blocksize/2, self._winsize + self._blocksize/2,
             anchor='nw', font='TkFixedFont', fill='white')
 
+        self._master.bind('<space>', lambda e: self.toggle_pause())
+        self._master.bind('<Right>', lambda e: self.step(1))
+        self._master.bind('<Left>', lambda e: self.step(-1))
+        self._master.bind('<Home>', lambda e: self.seek(0))
+        self._master.bind('<End>', lambda e: self.seek(len(self._source) - 1))
+        self._master.bind('f', lambda e: self.fast_forward())
+
         self.callback()
         self._win.mainloop()
 
@@ -32,40 +61,93 @@ class Render:
                     fill='black',
                     width=0)
 
+        # one item per square, recoloured as robots come and go. obstacles
+        # never change, so they are only coloured here.
+        obstacles = set(self._settings.obstacles)
+        for x in range(self._settings.board_size):
+            for y in range(self._settings.board_size):
+                color = '#222' if (x, y) in obstacles else 'white'
+                self._colors[(x, y)] = color
+                self._squares[(x, y)] = self._win.create_rectangle(
+                    x * self._blocksize + 20, y * self._blocksize + 20,
+                    x * self._blocksize + self._blocksize - 3 + 20, y * self._blocksize + self._blocksize - 3 + 20,
+                    fill=color, width=0)
+
     def draw_square(self, loc, color):
         if self._colors[loc] == color:
             return
 
         self._colors[loc] = color
-        x, y = loc
-        self._win.create_rectangle(x * self._blocksize + 20, y * self._blocksize + 20,
-            x * self._blocksize + self._blocksize - 3 + 20, y * self._blocksize + self._blocksize - 3 + 20,
-            fill=color, width=0)
+        self._win.itemconfig(self._squares[loc], fill=color)
 
-    def update_title(self, turns, max_turns):
-        red, green = self._game.get_scores()
+    def update_title(self, turn, robots):
+        scores = [0, 0]
+        for loc, hp, player_id in robots:
+            scores[player_id] += 1
+        status = ''
+        if not self._playing:
+            status = ' | paused'
+        elif self._speed:
+            status = ' | x%d' % FAST_FORWARD[self._speed]
+        if self._position >= len(self._source) - 1 and not self._source.done():
+            status += ' | waiting'
         self._win.itemconfig(self._label,
-            text='Red: %d | Green: %d | Turn: %d/%d' % (
-                red, green, turns, max_turns))
+            text='Red: %d | Green: %d | Turn: %d/%d%s' % (
+                scores[0], scores[1], turn, self._source.total - 1, status))
+
+    def toggle_pause(self):
+        self._playing = not self._playing
+        self.show()
+
+    def fast_forward(self):
+        self._speed = (self._speed + 1) % len(FAST_FORWARD)
+        self._playing = True
+        self.show()
+
+    def step(self, turns):
+        self._playing = False
+        self.seek(self._position + turns)
+
+    def seek(self, index):
+        self._position = max(0, min(index, len(self._source) - 1))
+        self._source.request(self._position)
+        self.show()
+
+    def on_seek(self, value):
+        # the slider also reports the moves show() makes
+        if int(value) != self._position:
+            self.seek(int(value))
 
     def callback(self):
-        self._game.run_turn()
-        self.paint()
-        self.update_title(self._game.turns, self._settings.max_turns)
-
-        if self._game.turns < self._settings.max_turns:
-            self._win.after(self._settings.turn_interval, self.callback)
-
-    def determine_color(self, loc):
-        if loc in self._settings.obstacles:
-            return '#222'
-        robot = self._game.robot_at_loc(loc)
-        if robot is not None:
-            return 'red' if robot == 0 else 'green'
-        return 'white'
-
-    def paint(self):
-        for y in range(self._settings.board_size):
-            for x in range(self._settings.board_size):
-                loc = (x, y)
-                self.draw_square(loc, self.determine_color(loc))
+        if self._playing:
+            if self._position >= self._source.total - 1:
+                self._playing = False
+            else:
+                # skipped frames are never painted
+                self.seek(self._position + FAST_FORWARD[self._speed])
+        self.show()
+        self._win.after(self._settings.turn_interval, self.callback)
+
+    def show(self):
+        turn, robots = self._source.frame(self._position)
+        if self._shown != self._position:
+            self.paint(robots)
+            self._shown = self._position
+            self._slider.set(self._position)
+        self.update_title(turn, robots)
+
+    def determine_color(self, robot):
+        return 'red' if robot['player_id'] == 0 else 'green'
+
+    def paint(self, robots):
+        # only squares that held or hold a robot can change
+        robot_colors = dict((loc, self.determine_color(
+                {'location': loc, 'hp': hp, 'player_id': player_id}))
+            for loc, hp, player_id in robots)
+
+        for loc in self._robot_colors:
+            if loc not in robot_colors:
+                self.draw_square(loc, 'white')
+        for loc, color in robot_colors.iteritems():
+            self.draw_square(loc, color)
+        self._robot_colors = robot_colors
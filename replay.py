@@ -0,0 +1,161 @@
+import array
+import struct
+import sys
+import zlib
+
+# replays are streamed to disk one frame per turn. a frame holds the robots
+# left at the end of the turn and the actions issued during it, as
+# zlib-compressed little-endian arrays. closing the writer appends an index
+# of frame offsets, so a reader can seek to any turn without decoding the
+# frames before it; an unfinished replay is still readable by walking the
+# frame headers.
+#
+#   header   magic, version, board size, seed (-1 if unknown)
+#   frame    payload length, turn, robot count, action count, payload
+#   payload  robot x, y, hp, player_id arrays, then
+#            action x, y, command, target x, y arrays
+#   index    frame offsets, then index offset, frame count, index magic
+
+MAGIC = 'RGRP'
+INDEX_MAGIC = 'RGIX'
+VERSION = 1
+
+HEADER = struct.Struct('<4sBHq')
+FRAME = struct.Struct('<IIHH')
+TRAILER = struct.Struct('<II4s')
+
+COMMANDS = ('guard', 'move', 'attack', 'suicide')
+NO_TARGET = 255
+
+def to_bytes(arr):
+    if sys.byteorder == 'big':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tostring()
+
+def from_bytes(typecode, data):
+    arr = array.array(typecode)
+    arr.fromstring(data)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+def encode_target(action, board_size):
+    try:
+        x, y = action[1]
+        if 0 <= x < board_size and 0 <= y < board_size:
+            return int(x), int(y)
+    except Exception:
+        pass
+    return NO_TARGET, NO_TARGET
+
+class ReplayWriter:
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._offsets = array.array('I')
+        self._board_size = None
+
+    def write_header(self, board_size, seed=None):
+        if board_size >= NO_TARGET:
+            raise ValueError('board too large for replay format')
+        self._board_size = board_size
+        self._file.write(HEADER.pack(MAGIC, VERSION, board_size,
+            -1 if seed is None else seed))
+        self._offset = HEADER.size
+
+    def write_turn(self, turn, robots, actions):
+        columns = [array.array(x) for x in 'BBhB']
+        for robot in robots:
+            columns[0].append(robot.location[0])
+            columns[1].append(robot.location[1])
+            columns[2].append(robot.hp)
+            columns[3].append(robot.player_id)
+
+        action_columns = [array.array('B') for i in range(5)]
+        for loc, action in actions.iteritems():
+            target = encode_target(action, self._board_size)
+            for column, value in zip(action_columns,
+                    (loc[0], loc[1], COMMANDS.index(action[0])) + target):
+                column.append(value)
+
+        payload = zlib.compress(''.join(to_bytes(x)
+            for x in columns + action_columns))
+        self._file.write(FRAME.pack(len(payload), turn, len(robots), len(actions)))
+        self._file.write(payload)
+        self._offsets.append(self._offset)
+        self._offset += FRAME.size + len(payload)
+
+    def close(self):
+        self._file.write(to_bytes(self._offsets))
+        self._file.write(TRAILER.pack(self._offset, len(self._offsets), INDEX_MAGIC))
+        self._file.close()
+
+class ReplayReader:
+    def __init__(self, fileobj):
+        if isinstance(fileobj, basestring):
+            fileobj = open(fileobj, 'rb')
+        self._file = fileobj
+
+        magic, version, self.board_size, seed = HEADER.unpack(
+            self._file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('not a robot game replay')
+        if version > VERSION:
+            raise ValueError('unsupported replay version %d' % version)
+        self.seed = None if seed == -1 else seed
+        self._offsets = self.read_index()
+
+    def read_index(self):
+        self._file.seek(0, 2)
+        size = self._file.tell()
+        if size >= HEADER.size + TRAILER.size:
+            self._file.seek(size - TRAILER.size)
+            offset, count, magic = TRAILER.unpack(self._file.read(TRAILER.size))
+            if magic == INDEX_MAGIC:
+                self._file.seek(offset)
+                return from_bytes('I', self._file.read(count * 4))
+
+        # no index, the replay was not closed: walk the frame headers
+        offsets = array.array('I')
+        offset = HEADER.size
+        while offset + FRAME.size <= size:
+            self._file.seek(offset)
+            length = FRAME.unpack(self._file.read(FRAME.size))[0]
+            if offset + FRAME.size + length > size:
+                break
+            offsets.append(offset)
+            offset += FRAME.size + length
+        return offsets
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.read_turn(i)
+
+    def read_turn(self, index):
+        self._file.seek(self._offsets[index])
+        length, turn, robot_count, action_count = FRAME.unpack(
+            self._file.read(FRAME.size))
+        data = zlib.decompress(self._file.read(length))
+
+        columns = []
+        offset = 0
+        for typecode, count in zip('BBhBBBBBB', [robot_count] * 4 + [action_count] * 5):
+            size = array.array(typecode).itemsize * count
+            columns.append(from_bytes(typecode, data[offset:offset + size]))
+            offset += size
+
+        robots = [((x, y), hp, player_id)
+            for x, y, hp, player_id in zip(*columns[:4])]
+        actions = {}
+        for x, y, cmd, tx, ty in zip(*columns[4:]):
+            action = [COMMANDS[cmd]]
+            if COMMANDS[cmd] in ('move', 'attack'):
+                action.append(None if tx == NO_TARGET else (tx, ty))
+            actions[(x, y)] = action
+        return turn, robots, actions
+
+    def close(self):
+        self._file.close()
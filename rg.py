@@ -1,6 +1,8 @@
 # users will import rg to be able to use robot game functions
+import collections
 import math
 import operator
+import threading
 
 settings = None
 
@@ -8,22 +10,215 @@ settings = None
 
 CENTER_POINT = None
 
-def after_settings():
-    global CENTER_POINT
-    global settings
-    CENTER_POINT = (int(settings.board_size / 2), int(settings.board_size / 2))
+LOC_TYPES = ('normal', 'spawn', 'obstacle', 'invalid')
+
+# walking distance fields per target, least recently used dropped first
+FIELD_CACHE_SIZE = 512
+
+class ReadOnlyDict(dict):
+    # a dict handed to user code that others share, like the game info or a
+    # cached distance field. the owner fills it through dict's own methods;
+    # copies come back as plain dicts.
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('%s is read-only' % self.what)
+
+    what = 'this dict'
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def copy(self):
+        return dict(self)
+
+class MapIndex:
+    # static lookups for one settings object: square types, neighbour lists
+    # per combination of filtered types (built on first use) and walking
+    # distance fields
+    def __init__(self, settings):
+        self.settings = settings
+        self.center = (int(settings.board_size / 2), int(settings.board_size / 2))
+
+        self.loc_types = {}
+        compiled = settings.get('compiled_map')
+        if compiled is not None and compiled.board_size == settings.board_size:
+            # the type bits of the compiled map, read in one go
+            names = [('normal',), ('normal', 'spawn'), ('normal', 'obstacle'),
+                ('normal', 'spawn', 'obstacle')]
+            self.loc_types = dict(zip(
+                [(x, y) for x in range(settings.board_size)
+                    for y in range(settings.board_size)],
+                [names[x] for x in compiled.all_types()]))
+        else:
+            compiled = None
+            spawn = set(settings.spawn_coords)
+            obstacles = set(settings.obstacles)
+            for x in range(settings.board_size):
+                for y in range(settings.board_size):
+                    types = ['normal']
+                    if (x, y) in spawn:
+                        types.append('spawn')
+                    if (x, y) in obstacles:
+                        types.append('obstacle')
+                    self.loc_types[(x, y)] = tuple(types)
+        self.compiled = compiled
+        self.neighbours = {}
+
+        # walkable squares in the order of the compiled map's distance rows
+        self.walkable = [(x, y)
+            for x in range(settings.board_size)
+            for y in range(settings.board_size)
+            if 'obstacle' not in self.loc_types[(x, y)]]
+        self.fields = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        if compiled is not None:
+            # the walkable neighbours the engine and the searches use come
+            # from the compiled map; only obstacles are looked at here
+            rows = compiled.all_neighbours()
+            walkable = self.walkable
+            table = dict((loc, tuple(walkable[j] for j in rows[i * 4:i * 4 + 4] if j >= 0))
+                for i, loc in enumerate(walkable))
+            key = frozenset(('invalid', 'obstacle'))
+            table.update(self.build_neighbours(key,
+                [x for x in self.loc_types if 'obstacle' in self.loc_types[x]]))
+            self.neighbours[key] = self.neighbours[('invalid', 'obstacle')] = table
+
+    def neighbours_table(self, filter_out):
+        try:
+            return self.neighbours[filter_out]
+        except KeyError:
+            pass
+        except TypeError:
+            filter_out = tuple(filter_out)
+            if filter_out in self.neighbours:
+                return self.neighbours[filter_out]
+
+        key = frozenset(filter_out) & frozenset(LOC_TYPES)
+        if key not in self.neighbours:
+            self.neighbours[key] = self.build_neighbours(key, self.loc_types)
+        self.neighbours[filter_out] = self.neighbours[key]
+        return self.neighbours[key]
+
+    def build_neighbours(self, key, squares):
+        # the neighbours of each of squares whose types are disjoint from key
+        offsets = ((0, 1), (1, 0), (0, -1), (-1, 0))
+        invalid = ('invalid',)
+        table = {}
+        for (x, y) in squares:
+            locs = []
+            for dx, dy in offsets:
+                loc = (x + dx, y + dy)
+                if key.isdisjoint(self.loc_types.get(loc, invalid)):
+                    locs.append(loc)
+            table[(x, y)] = tuple(locs)
+        return table
+
+    def distance_field(self, dest):
+        # the cache may be shared by games in several threads
+        with self.lock:
+            fields = self.fields
+            try:
+                field = fields.pop(dest)
+            except KeyError:
+                field = self.build_distance_field(dest)
+            except TypeError:
+                dest = tuple(dest)
+                field = fields.pop(dest, None) or self.build_distance_field(dest)
+            fields[dest] = field
+            if len(fields) > FIELD_CACHE_SIZE:
+                fields.popitem(last=False)
+            return field
+
+    def build_distance_field(self, dest):
+        if self.compiled is not None and self.compiled.has_distances:
+            i = self.compiled.cell_index(dest)
+            if i < 0:
+                return ReadOnlyDict()
+            return ReadOnlyDict((loc, d)
+                for loc, d in zip(self.walkable, self.compiled.distance_row(i))
+                if d != 0xffff)
+
+        # no compiled map or distance table, search from dest
+        if 'obstacle' in self.loc_types.get(dest, ('obstacle',)):
+            return ReadOnlyDict()
+        around = self.neighbours_table(('invalid', 'obstacle'))
+        field = {dest: 0}
+        queue = collections.deque([dest])
+        while queue:
+            loc = queue.popleft()
+            d = field[loc] + 1
+            for n in around[loc]:
+                if n not in field:
+                    field[n] = d
+                    queue.append(n)
+        return ReadOnlyDict(field)
+
+# the index of the module level settings, and per thread the index of the
+# game being played there, if it has settings of its own. games switch
+# their index in when they play a turn, so rg reaches the right map
+# without being told.
+class _Local(threading.local):
+    index = None
+
+_default = None
+_local = _Local()
 
 def set_settings(s):
     global settings
+    global _default
     settings = s
+    _default = MapIndex(s)
     after_settings()
 
+def after_settings():
+    global CENTER_POINT
+    CENTER_POINT = active().center
+
+def activate(index):
+    # index is a MapIndex, or None for the module level settings.
+    # CENTER_POINT is a plain module constant, shared by all threads; code
+    # running games on different board sizes side by side should use
+    # center_point() instead.
+    _local.index = index
+    after_settings()
+
+def index_for(s):
+    # the index of a game's own settings, kept with them
+    index = s.get('map_index')
+    if index is None or index.settings is not s:
+        index = s.map_index = MapIndex(s)
+    return index
+
+def active():
+    return _local.index or _default
+
+def center_point():
+    return active().center
+
+def active_settings():
+    # the settings of the game being played. like CENTER_POINT, the module
+    # level rg.settings stays with set_settings and does not follow games
+    # that have settings of their own
+    return active().settings
+
+def neighbours_table(filter_out):
+    return active().neighbours_table(filter_out)
+
 ##############################
 
 dist = lambda p1, p2: math.sqrt((p2[0]-p1[0])**2 + (p2[1]-p1[1])**2)
 wdist = lambda p1, p2: abs(p2[0]-p1[0]) + abs(p2[1]-p1[1])
 
 def loc_types(loc):
+    try:
+        return list((_local.index or _default).loc_types[loc])
+    except (KeyError, TypeError):
+        return _loc_types_slow(loc)
+
+def _loc_types_slow(loc):
+    settings = active().settings
     for i in range(2):
         if not (0 <= loc[i] < settings.board_size):
             return ['invalid']
@@ -35,13 +230,23 @@ def loc_types(loc):
     return types
 
 def locs_around(loc, filter_out=None):
-    filter_out = filter_out or []
+    filter_out = filter_out or ()
+    try:
+        return list((_local.index or _default).neighbours[filter_out][loc])
+    except (KeyError, TypeError):
+        pass
+    try:
+        return list(active().neighbours_table(filter_out)[loc])
+    except (KeyError, TypeError):
+        return _locs_around(loc, filter_out)
+
+def _locs_around(loc, filter_out):
     offsets = ((0, 1), (1, 0), (0, -1), (-1, 0))
     locs = []
 
     for o in offsets:
         new_loc = tuple(map(operator.add, loc, o))
-        if len(set(filter_out) & set(loc_types(new_loc))) == 0:
+        if len(set(filter_out) & set(_loc_types_slow(new_loc))) == 0:
             locs.append(new_loc)
     return locs
 
@@ -56,3 +261,31 @@ def toward(curr, dest):
     if abs(x_diff) < abs(y_diff):
         return (x0, y0 + y_diff / abs(y_diff))
     return (x0 + x_diff / abs(x_diff), y0)
+
+def distance_field(dest):
+    # walking distance from every square that can reach dest; empty if dest
+    # is not walkable. the field is shared through the cache, so it is
+    # read-only
+    return active().distance_field(dest)
+
+def walk_dist(curr, dest):
+    # number of moves from curr to dest around obstacles, None if there is
+    # no way there
+    return distance_field(dest).get(tuple(curr))
+
+def next_step(curr, dest):
+    # the square to move to from curr on a shortest walk to dest, the same
+    # one toward() picks whenever that is on a shortest walk. curr itself if
+    # it already is dest or dest cannot be reached
+    field = distance_field(dest)
+    curr = tuple(curr)
+    d = field.get(curr)
+    if not d:
+        return curr
+    step = toward(curr, dest)
+    if field.get(step) == d - 1:
+        return step
+    for loc in active().neighbours_table(('invalid', 'obstacle'))[curr]:
+        if field.get(loc) == d - 1:
+            return loc
+    return curr
@@ -1,22 +1,43 @@
+import frames
 import game
+import registry
 import render
+import replay
+import sandbox
 import sys
 import os
 
 def make_player(fname):
-    return game.Player(open(fname).read())
+    return sandbox.SandboxedPlayer(registry.read_bot(fname))
+
+def usage():
+    print 'usage: python run.py <usercode1.py> <usercode2.py> [<map file>]'
+    print '       python run.py --replay <replay file> [<map file>]'
+    sys.exit()
 
 if __name__ == '__main__':
     if len(sys.argv) < 3:
-        print 'usage: python run.py <usercode1.py> <usercode2.py> [<map file>]'
-        sys.exit()
-
-    players = [make_player(x) for x in sys.argv[1:3]]
-    g = game.Game(*players)
+        usage()
 
     map_name = os.path.join(os.path.dirname(__file__), 'maps/default.py')
     if len(sys.argv) > 3:
         map_name = sys.argv[3]
 
-    game.init_settings(map_name)
-    render.Render(g, game.settings)
+    if sys.argv[1] == '--replay':
+        reader = replay.ReplayReader(sys.argv[2])
+        game.settings.board_size = reader.board_size
+        game.init_settings(map_name)
+        source = frames.ReplayFrames(reader)
+        players = []
+    else:
+        game.init_settings(map_name)
+        players = [make_player(x) for x in sys.argv[1:3]]
+        g = game.Game(*players)
+        source = frames.GameFrames(g, game.settings.max_turns)
+
+    try:
+        render.Render(source, game.settings)
+    finally:
+        source.close()
+        for player in players:
+            player.close()
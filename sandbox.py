@@ -0,0 +1,216 @@
+import json
+import multiprocessing
+import random
+import signal
+import time
+import traceback
+###
+import errorlog
+import game
+import instrument
+import registry
+import rg
+from settings import settings
+
+# players whose code runs in a separate, persistent worker process. every
+# turn the parent sends one message with the game info and the locations of
+# the player's robots, and the worker answers with all of their actions.
+# user code is limited to max_usercode_time per act() call and
+# max_usercode_turn_time per turn (both in milliseconds), which an
+# act_all() call may use up in full; a robot that runs out of time guards,
+# just like one that raises. answers are json, so the
+# parent never unpickles anything user code could have touched.
+
+class UsercodeTimeout(Exception):
+    pass
+
+def raise_timeout(signum, frame):
+    raise UsercodeTimeout('robot exceeded its time limit')
+
+class RobotState:
+    def __init__(self, info):
+        self.__dict__.update(info)
+
+class WorkerPlayer(game.Player):
+    def __init__(self, code):
+        self._deadline = None
+        self.start_turn()
+        try:
+            game.Player.__init__(self, code)
+            self.get_robot()
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    def start_turn(self):
+        self._deadline = time.time() + settings.max_usercode_turn_time / 1000.0
+        signal.setitimer(signal.ITIMER_REAL, settings.max_usercode_turn_time / 1000.0)
+
+    def call_limited(self, func, game_info, limit=None):
+        remaining = self._deadline - time.time()
+        if remaining <= 0:
+            raise UsercodeTimeout('player exceeded its time limit for this turn')
+        if limit is not None:
+            remaining = min(limit, remaining)
+        signal.setitimer(signal.ITIMER_REAL, remaining)
+        try:
+            return func(game_info)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    def call_act(self, user_robot, game_info):
+        return self.call_limited(user_robot.act, game_info,
+            settings.max_usercode_time / 1000.0)
+
+    def call_act_all(self, user_robot, game_info):
+        # planning the whole turn may use the whole turn's time
+        return self.call_limited(user_robot.act_all, game_info)
+
+def make_game_info(turn, robots, previous):
+    robot_info = game.ReadOnlyDict((loc, game.ReadOnlyDict(info))
+        for loc, info in robots.iteritems())
+    changes = dict((loc, robot_info[loc]) for loc, info in robots.iteritems()
+        if previous.get(loc) != info)
+    changes.update((loc, None) for loc in previous if loc not in robots)
+    return game.ReadOnlyDict(robots=robot_info, turn=turn,
+        changes=game.ReadOnlyDict(changes))
+
+def worker_main(conn, code, worker_settings, seed):
+    settings.update(worker_settings)
+    rg.set_settings(settings)
+    random.seed(seed)
+    signal.signal(signal.SIGALRM, raise_timeout)
+    # errors go back to the parent's log as counts per site, with the
+    # traceback only the first time a site is seen
+    error_log = errorlog.ErrorLog(echo=False)
+
+    try:
+        player = WorkerPlayer(code)
+    except Exception:
+        player = None
+        error = traceback.format_exc()
+
+    previous = {}
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        turn, new_turn, robots, locs, timed = message
+
+        if player is None:
+            for loc in locs:
+                error_log.record(robots[loc]['player_id'], loc, error)
+            conn.send_bytes(json.dumps(([['guard']] * len(locs),
+                error_log.drain(), None)))
+            continue
+
+        player.start_turn()
+        try:
+            if new_turn:
+                player.notify_new_turn()
+        except Exception:
+            text = traceback.format_exc()
+            for loc in locs:
+                error_log.record(robots[loc]['player_id'], loc, text)
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+        game_info = make_game_info(turn, robots, previous)
+        previous = robots
+        states = [RobotState(robots[loc]) for loc in locs]
+        profiler = instrument.Profiler() if timed else None
+        actions = player.get_actions(states, game_info, profiler, error_log)
+        stats = profiler and profiler.players
+        conn.send_bytes(json.dumps(([actions[x] for x in states], error_log.drain(),
+            stats), default=repr))
+
+def as_action(data):
+    # json turns tuples into lists; the engine expects tuple locations
+    if not isinstance(data, list) or len(data) == 0:
+        return None
+    return [data[0]] + [tuple(x) if isinstance(x, list) else x for x in data[1:]]
+
+class SandboxedPlayer:
+    def __init__(self, code, seed=None):
+        self._code = code
+        self._seed = seed
+        self._new_turn = False
+        self._process = None
+        # compile in the parent, so every worker forked for this bot
+        # inherits the code object. a bot that does not compile is
+        # reported by the worker like any other error.
+        try:
+            registry.compile_code(code)
+        except Exception:
+            pass
+
+    def start_worker(self):
+        # started by the first turn, so the worker gets the settings of the
+        # game it plays in
+        worker_settings = dict((key, value)
+            for key, value in rg.active().settings.iteritems() if key != 'map_index')
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=worker_main,
+            args=(child_conn, self._code, worker_settings, self._seed))
+        self._process.daemon = True
+        self._process.start()
+
+    def stop_worker(self):
+        self._process.terminate()
+        self._process.join()
+        self._process = None
+
+    def notify_new_turn(self):
+        self._new_turn = True
+
+    def get_actions(self, robots, game_info, profiler=None, error_log=None):
+        if self._process is None:
+            self.start_worker()
+
+        robot_info = dict((loc, dict(info))
+            for loc, info in game_info['robots'].iteritems())
+        self._conn.send((game_info['turn'], self._new_turn, robot_info,
+            [x.location for x in robots], profiler is not None))
+        self._new_turn = False
+
+        # allow for the worker's own overhead on top of the turn limit
+        timeout = rg.active().settings.max_usercode_turn_time / 1000.0 + 1
+        try:
+            if not self._conn.poll(timeout):
+                raise UsercodeTimeout('player did not answer in time')
+            next_actions, errors, stats = json.loads(self._conn.recv_bytes())
+            if len(next_actions) != len(robots):
+                raise ValueError('player answered for the wrong robots')
+        except Exception:
+            # a stuck or misbehaving worker is replaced next turn
+            self.stop_worker()
+            text = traceback.format_exc()
+            for robot in robots:
+                errorlog.report(error_log, robot.player_id, robot.location, text)
+                if profiler is not None:
+                    profiler.record_exception(robot.player_id)
+            return dict((x, ['guard']) for x in robots)
+
+        if error_log is not None:
+            error_log.merge(errors)
+        else:
+            for key, location, text, count in errors:
+                if text is not None:
+                    errorlog.print_robot_exception(tuple(location), text)
+        if profiler is not None and stats is not None:
+            for player_id, player in enumerate(stats):
+                profiler.add_player_stats(player_id, player)
+
+        actions = {}
+        for robot, data in zip(robots, next_actions):
+            action = as_action(data)
+            if action is None or not game.InternalRobot.is_valid_action(action):
+                action = ['guard']
+            actions[robot] = action
+        return actions
+
+    def close(self):
+        if self._process is not None:
+            self._conn.send(None)
+            self._process.join(1)
+            if self._process.is_alive():
+                self.stop_worker()
+            self._process = None
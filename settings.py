@@ -8,6 +8,7 @@ settings = {
     'collision_damage': 5,
     'suicide_damage': 10,
     'max_turns': 100,
+    'map_cache_dir': '~/.cache/rgkit/maps',
     
     # rendering
     'turn_interval': 100,
@@ -18,6 +19,8 @@ settings = {
 
     # user-scripting
     'max_usercode_time': 100,
+    'max_usercode_turn_time': 1000,
+    'max_error_reports': 10,
     'exposed_properties': ('location', 'hp', 'player_id'),
     'valid_commands': ('move', 'attack', 'guard', 'suicide'),
 }
@@ -0,0 +1,160 @@
+import argparse
+import hashlib
+import itertools
+import multiprocessing
+import os
+import sqlite3
+###
+import batch
+from settings import settings
+
+# a ladder over a pool of bots. bots are identified by the hash of their
+# code and every match by (bot hash, opponent hash, map hash, seed), so
+# replaying the ladder only plays matches that have not been played before
+# -- after changing one bot, just the matches involving it. ratings are
+# updated elo-style as results come in and kept, with all results, in a
+# sqlite file.
+
+K_FACTOR = 32
+
+SCHEMA = '''
+create table if not exists bots (
+    hash text primary key,
+    name text not null,
+    rating real not null,
+    games integer not null default 0
+);
+create table if not exists matches (
+    bot1 text not null,
+    bot2 text not null,
+    map text not null,
+    seed integer not null,
+    score1 integer not null,
+    score2 integer not null,
+    primary key (bot1, bot2, map, seed)
+);
+'''
+
+def file_hash(fname):
+    return hashlib.sha1(open(fname, 'rb').read()).hexdigest()
+
+def expected_score(rating, other):
+    return 1.0 / (1 + 10 ** ((other - rating) / 400.0))
+
+def match_score(scores):
+    if scores[0] == scores[1]:
+        return 0.5
+    return 1.0 if scores[0] > scores[1] else 0.0
+
+class Ladder:
+    def __init__(self, db_file):
+        self._db = sqlite3.connect(db_file)
+        self._db.executescript(SCHEMA)
+
+    def add_bot(self, bot_hash, name):
+        self._db.execute('insert or ignore into bots (hash, name, rating) values (?, ?, ?)',
+            (bot_hash, name, settings.default_rating))
+        self._db.execute('update bots set name = ? where hash = ?', (name, bot_hash))
+        self._db.commit()
+
+    def rating(self, bot_hash):
+        return self._db.execute('select rating from bots where hash = ?',
+            (bot_hash,)).fetchone()[0]
+
+    def has_result(self, bot1, bot2, map_hash, seed):
+        return self._db.execute('select 1 from matches where bot1 = ? and bot2 = ? '
+            'and map = ? and seed = ?', (bot1, bot2, map_hash, seed)).fetchone() is not None
+
+    def record(self, bot1, bot2, map_hash, seed, scores):
+        score = match_score(scores)
+        rating1, rating2 = self.rating(bot1), self.rating(bot2)
+        change = K_FACTOR * (score - expected_score(rating1, rating2))
+
+        self._db.execute('insert into matches values (?, ?, ?, ?, ?, ?)',
+            (bot1, bot2, map_hash, seed, scores[0], scores[1]))
+        self._db.execute('update bots set rating = rating + ?, games = games + 1 '
+            'where hash = ?', (change, bot1))
+        self._db.execute('update bots set rating = rating - ?, games = games + 1 '
+            'where hash = ?', (change, bot2))
+        self._db.commit()
+
+    def standings(self, bot_hashes):
+        rows = self._db.execute('select hash, name, rating, games from bots').fetchall()
+        return sorted((x for x in rows if x[0] in bot_hashes),
+            key=lambda x: x[2], reverse=True)
+
+def make_pairs(ladder, hashes):
+    # bots play everyone within rating_range of them, and at least their
+    # closest opponent
+    pairs = set()
+    ratings = dict((x, ladder.rating(x)) for x in hashes)
+    for bot in hashes:
+        others = sorted((abs(ratings[x] - ratings[bot]), x) for x in hashes if x != bot)
+        for i, (diff, other) in enumerate(others):
+            if i == 0 or diff <= settings.rating_range:
+                pairs.add(tuple(sorted((bot, other))))
+    return sorted(pairs)
+
+def schedule(ladder, bots, map_file, games):
+    hashes = dict((file_hash(x), x) for x in bots)
+    for bot_hash, fname in hashes.iteritems():
+        ladder.add_bot(bot_hash, os.path.basename(fname))
+    map_hash = file_hash(map_file)
+
+    jobs = []
+    for bot1, bot2 in make_pairs(ladder, list(hashes)):
+        for seed in range(games):
+            pairing = (bot1, bot2) if seed % 2 == 0 else (bot2, bot1)
+            if not ladder.has_result(pairing[0], pairing[1], map_hash, seed):
+                jobs.append(((hashes[pairing[0]], hashes[pairing[1]]), {'seed': seed}))
+    return hashes, map_hash, jobs
+
+def run_tournament(ladder, bots, map_file=batch.default_map, games=10,
+        processes=None):
+    hashes, map_hash, jobs = schedule(ladder, bots, map_file, games)
+    names = dict((fname, bot_hash) for bot_hash, fname in hashes.iteritems())
+
+    batch.init_worker(map_file)
+    if processes == 1:
+        results = itertools.imap(batch.run_job, jobs)
+    else:
+        pool = multiprocessing.Pool(processes, batch.init_worker, (map_file,))
+        results = pool.imap_unordered(batch.run_job, jobs)
+
+    try:
+        for result in results:
+            bot1, bot2 = [names[x] for x in result['players']]
+            ladder.record(bot1, bot2, map_hash, result['seed'], result['scores'])
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+    return len(jobs), ladder.standings(set(hashes))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Rate a pool of bots against each other.')
+    parser.add_argument('bots', nargs='+', help='bot files or directories of bots')
+    parser.add_argument('-n', '--games', type=int, default=10,
+        help='number of matches (seeds) per pairing')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+        help='worker processes (default: one per cpu)')
+    parser.add_argument('-m', '--map', default=batch.default_map, help='map file')
+    parser.add_argument('-d', '--db', default='ladder.db',
+        help='sqlite file holding ratings and results')
+    args = parser.parse_args(argv)
+
+    bots = list(itertools.chain.from_iterable(batch.find_bots(x) for x in args.bots))
+    if len(bots) < 2:
+        parser.error('need at least two bots')
+
+    played, standings = run_tournament(Ladder(args.db), bots, args.map,
+        args.games, args.processes)
+    print '%d new matches played' % played
+    width = max(len(x[1]) for x in standings)
+    print '%-*s %8s %6s' % (width, 'bot', 'rating', 'games')
+    for bot_hash, name, rating, games in standings:
+        print '%-*s %8.1f %6d' % (width, name, rating, games)
+
+if __name__ == '__main__':
+    main()